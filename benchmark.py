@@ -0,0 +1,356 @@
+#! /usr/bin/env python
+""" A benchmark suite for the hot paths of the library.
+
+Each benchmark is run for a few problem sizes, and the best and median of
+several timings are recorded; results can be saved to JSON, and two saved
+runs compared to flag regressions. Everything runs offline, on synthetic
+data from a fixed seed, including generated Code Jam input files.
+
+Usage:
+    python benchmark.py run [-o results.json] [-k FILTER] [-r REPEATS] [-q]
+    python benchmark.py compare old.json new.json [-t THRESHOLD]
+    python benchmark.py list
+"""
+from __future__ import print_function, division
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, LIB_DIR)
+
+BENCHMARKS = [] # (name, sizes, function) for each benchmark.
+SEED = 12345
+THRESHOLD = 1.25 # Slowdowns by more than this factor are regressions.
+
+def benchmark(*sizes):
+    """ Decorator. Registers a benchmark, to be run for each of the given
+    problem sizes; the function takes a size, does any setup, and returns
+    a function of no arguments that does the work to be timed.
+    """
+    def register(fun):
+        BENCHMARKS.append((fun.__name__, sizes, fun))
+        return fun
+    return register
+
+def _rng(size):
+    """ Returns a random number generator seeded for the given size. """
+    return random.Random(SEED + size)
+
+# Primes.
+
+@benchmark(10**7, 10**8)
+def primes_extend(size):
+    import primes
+    def run():
+        p = primes.Primes32(primes_path=None)
+        p.ip(size)
+    return run
+
+@benchmark(10**12, 10**15)
+def primes_window(size):
+    import primes
+    p = primes.Primes32(primes_path=None)
+    return lambda: p.between(size, size + 10**7)
+
+@benchmark(10**4, 10**5)
+def primes_is_prime(size):
+    import primes
+    rng = _rng(size)
+    ns = [rng.randrange(2**40, 2**63) | 1 for _ in range(size)]
+    return lambda: [primes.is_prime(n) for n in ns]
+
+@benchmark(100, 1000)
+def primes_pf(size):
+    import primes
+    rng = _rng(size)
+    # Beyond the smallest-factor table, and with two large factors.
+    ns = [rng.randrange(2**20, 2**31) * rng.randrange(2**20, 2**31)
+          for _ in range(size)]
+    return lambda: [primes.pf(n) for n in ns]
+
+@benchmark(10**9, 10**11)
+def primes_prime_pi(size):
+    import primes
+    return lambda: primes.prime_pi(size)
+
+@benchmark(10**6, 10**7)
+def multiplicative_phi(size):
+    import multiplicative
+    return lambda: multiplicative.phi(size)
+
+# Graphs.
+
+def _random_edges(rng, n, degree):
+    """ Returns random bipartite edges, with n nodes on each side, labelled
+    ('l', u) and ('r', v) so that the two sides stay distinct.
+    """
+    edges = set()
+    for u in range(n):
+        for _ in range(degree):
+            edges.add((('l', u), ('r', rng.randrange(n))))
+    return sorted(edges)
+
+@benchmark(10**3, 10**4)
+def graphs_hopcroft_karp(size):
+    import graphs
+    csr = graphs.csr_from_edges(_random_edges(_rng(size), size, 3))
+    return lambda: graphs.hopcroft_karp(csr)
+
+@benchmark(10**3, 10**4)
+def graphs_maximum_matching(size):
+    import graphs
+    import networkx as nx # Skipped if networkx is missing.
+    graph = nx.Graph()
+    graph.add_nodes_from(('l', u) for u in range(size))
+    graph.add_edges_from(_random_edges(_rng(size), size, 3))
+    left = [('l', u) for u in range(size)]
+    return lambda: graphs.maximum_matching(graph, left)
+
+@benchmark(100, 300)
+def graphs_hungarian(size):
+    import graphs
+    rng = _rng(size)
+    cost = [[rng.random() for _ in range(size)] for _ in range(size)]
+    return lambda: graphs.hungarian(cost)
+
+@benchmark(10**3, 5*10**3)
+def graphs_sparse_min_weight(size):
+    import graphs
+    rng = _rng(size)
+    csr = graphs.csr_from_edges(_random_edges(rng, size, 4))
+    weights = [rng.randrange(1, 1000) for _ in range(len(csr.indices))]
+    return lambda: graphs.sparse_min_weight_matching(csr, weights)
+
+@benchmark(10**4, 10**5)
+def graphs_dinic(size):
+    import graphs
+    rng = _rng(size)
+    n = size // 5
+    tails = [rng.randrange(n) for _ in range(size)]
+    heads = [rng.randrange(n) for _ in range(size)]
+    capacities = [rng.randrange(1, 100) for _ in range(size)]
+    return lambda: graphs.dinic(n, tails, heads, capacities, 0, 1)
+
+# Combinatorics.
+
+@benchmark(10**3, 10**4)
+def combinatorics_modulo_combs(size):
+    import combinatorics
+    rng = _rng(size)
+    queries = [(rng.randrange(10**18), rng.randrange(10**17))
+               for _ in range(size)]
+    return lambda: [combinatorics.modulo_combs(m, n, 10007)
+                    for m, n in queries]
+
+@benchmark(10**5, 10**6)
+def combinatorics_binomial_batch(size):
+    import numpy as np
+    import combinatorics
+    binomial = combinatorics.BinomialMod(10**9+7, 10**6)
+    rng = np.random.RandomState(SEED)
+    ns = rng.randint(0, 10**6, size)
+    ks = (ns * rng.random_sample(size)).astype(np.int64)
+    return lambda: binomial.batch(ns, ks)
+
+@benchmark(10**6, 10**7)
+def combinatorics_permutation_array(size):
+    import combinatorics
+    return lambda: combinatorics.multiset_permutation_array(
+        list(range(11)), 0, size)
+
+@benchmark(16, 22)
+def combinatorics_zeta(size):
+    import numpy as np
+    import combinatorics
+    values = np.random.RandomState(SEED).randint(0, 100, 1 << size)
+    return lambda: combinatorics.zeta_transform(values)
+
+# Memoization.
+
+@benchmark(10**5, 10**6)
+def memo_memoized(size):
+    import memo
+    def run():
+        @memo.memoized
+        def f(n):
+            return n * n
+        for i in range(size):
+            f(i % 1000)
+    return run
+
+# I/O.
+
+def _write_input(path, cases, numbers):
+    """ Writes a synthetic Code Jam input file, with the given number of
+    cases, each of which is a line with a count, then a line of numbers.
+    """
+    rng = _rng(cases)
+    with open(path, 'w') as f:
+        f.write("{}\n".format(cases))
+        for _ in range(cases):
+            f.write("{}\n".format(numbers))
+            f.write(' '.join(str(rng.randrange(10**9))
+                             for _ in range(numbers)) + '\n')
+
+def _sum_case(f_in, f_out, case_no, other_data):
+    """ Reads a case of the synthetic input with readline, as the template
+    does, and prints the sum of its numbers.
+    """
+    f_in.readline()
+    total = sum(int(x) for x in f_in.readline().split())
+    print("Case #{}: {}".format(case_no, total), file=f_out)
+
+@benchmark(10**3, 10**4)
+def io_process_input(size):
+    import codejam_io
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, 'bench.in')
+    _write_input(path, size, 100)
+    def run():
+        codejam_io.process_input(_sum_case, argv=[path, '-d', '-n'])
+    run.cleanup = lambda: shutil.rmtree(folder)
+    return run
+
+# Running and comparing.
+
+def run_benchmarks(pattern=None, repeats=3, quick=False):
+    """ Runs the benchmarks whose names contain the pattern, returning a
+    dictionary of results keyed by "name[size]".
+
+    A benchmark that needs a missing module (or whose setup returns None)
+    is recorded as skipped, and one that raises anything else as failed,
+    with the reason; either way the rest still run.
+    """
+    results = {}
+    for name, sizes, fun in BENCHMARKS:
+        if pattern and pattern not in name:
+            continue
+        for size in sizes[:1] if quick else sizes:
+            key = "{}[{}]".format(name, size)
+            try:
+                results[key] = _run_benchmark(fun, size, repeats)
+            except ImportError as e:
+                results[key] = {'skipped': str(e)}
+            except Exception as e:
+                results[key] = {'failed': "{}: {}".format(
+                    type(e).__name__, e)}
+            result = results[key]
+            if 'best' in result:
+                print("{:<45} {:>10.4f}s {:>10.4f}s".format(
+                    key, result['best'], result['median']))
+            else:
+                status = 'skipped' if 'skipped' in result else 'failed'
+                print("{:<45} {} ({})".format(key, status, result[status]))
+            sys.stdout.flush()
+    return results
+
+def _run_benchmark(fun, size, repeats):
+    """ Sets up and times a single benchmark at the given size. """
+    run = fun(size)
+    if run is None:
+        return {'skipped': "setup returned None"}
+    times = []
+    try:
+        for _ in range(repeats):
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+    finally:
+        getattr(run, 'cleanup', lambda: None)()
+    times.sort()
+    return {'best': times[0],
+            'median': times[len(times) // 2],
+            'repeats': repeats}
+
+def compare(old, new, threshold=THRESHOLD):
+    """ Prints the ratio of the best times of each benchmark in two runs,
+    and returns the keys of those that got slower by more than threshold.
+    """
+    regressions = []
+    print("{:<45} {:>10} {:>10} {:>7}".format("benchmark", "old", "new",
+                                              "ratio"))
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            print("{:<45} {}".format(key, "only in " +
+                                     ("new" if key in new else "old")))
+            continue
+        if 'best' not in old[key] or 'best' not in new[key]:
+            print("{:<45} {:>10} {:>10}".format(
+                key, _status(old[key]), _status(new[key])))
+            continue
+        ratio = new[key]['best'] / max(old[key]['best'], 1e-9)
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(key)
+        elif ratio < 1 / threshold:
+            flag = '  faster'
+        print("{:<45} {:>9.4f}s {:>9.4f}s {:>7.2f}{}".format(
+            key, old[key]['best'], new[key]['best'], ratio, flag))
+    return regressions
+
+def _status(result):
+    """ Describes a result briefly: its best time, or why it has none. """
+    if 'best' in result:
+        return "{:.4f}s".format(result['best'])
+    return 'skipped' if 'skipped' in result else 'failed'
+
+def _metadata():
+    """ Describes the machine and software that a run was made on. """
+    meta = {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    try:
+        import numpy
+        meta['numpy'] = numpy.__version__
+    except ImportError:
+        pass
+    return meta
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', help="run the benchmarks")
+    run.add_argument('-o', '--output', help="save the results to this file")
+    run.add_argument('-k', '--filter', help="only run matching benchmarks")
+    run.add_argument('-r', '--repeats', type=int, default=3)
+    run.add_argument('-q', '--quick', action='store_true',
+                     help="only run the smallest size of each benchmark")
+    comp = commands.add_parser('compare', help="compare two saved runs")
+    comp.add_argument('old')
+    comp.add_argument('new')
+    comp.add_argument('-t', '--threshold', type=float, default=THRESHOLD)
+    commands.add_parser('list', help="list the benchmarks")
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for name, sizes, _ in BENCHMARKS:
+            print("{:<35} {}".format(name, ', '.join(map(str, sizes))))
+    elif args.command == 'run':
+        results = run_benchmarks(args.filter, args.repeats, args.quick)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'meta': _metadata(), 'results': results}, f,
+                          indent=1, sort_keys=True)
+        if any('failed' in result for result in results.values()):
+            return 1
+    elif args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)['results']
+        with open(args.new) as f:
+            new = json.load(f)['results']
+        if compare(old, new, args.threshold):
+            return 1
+    else:
+        parser.print_help()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,9 +2,11 @@ from __future__ import print_function
 """ Some basic tools for command-line processing of Google Code Jam. """
 import os
 import sys
-import inspect
-import subprocess
-import zipfile
+import time
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 class MultiOutput(object):
     """ A simple class to duplicate output into multiple output files.
@@ -15,27 +17,422 @@ class MultiOutput(object):
 
     You can also provide sys.stdout among those files, but it
     it will not be closed when the MultiOutput is closed.
+
+    If buffered is True, written data is accumulated, and only written to
+    the files (in a single write each) by flush(), which process_input calls
+    at the end of every case, or once more than buffer_size characters are
+    waiting.
     """
-    def __init__(self, files):
+    def __init__(self, files, buffered=False, buffer_size=2**20):
         """ Creates the wrapper. """
         self._files = list(files)
+        self._buffered = buffered
+        self._buffer_size = buffer_size
+        self._buffer = []
+        self._size = 0
 
     def close(self):
         """ Closes all wrapped files, except sys.stdout. """
+        self.flush()
         for f in self._files:
             if f != sys.stdout:
                 f.close()
 
     def write(self, data):
         """ Writes the given data to all wrapped files. """
+        if self._buffered:
+            self._buffer.append(data)
+            self._size += len(data)
+            if self._size > self._buffer_size:
+                self.flush()
+            return
         for f in self._files:
             f.write(data)
             # Automatically flush stdout
             if f == sys.stdout:
                 f.flush()
 
+    def flush(self):
+        """ Writes out any buffered data, and flushes stdout. """
+        if self._buffer:
+            data = ''.join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            for f in self._files:
+                f.write(data)
+        for f in self._files:
+            if f == sys.stdout:
+                f.flush()
+
+class TokenReader(object):
+    """ A fast reader for whole input files, which reads the file in bulk
+    and then serves lines and whitespace-separated tokens from memory.
+
+    It supports the usual readline(), readlines(), read(), next() and
+    iteration over lines, as well as the name attribute, so it can stand in
+    for the input file itself, and adds typed helpers:
+    token(), int(), float(), ints(n), floats(n), and array(shape) for
+    numpy arrays. The token helpers continue from where the last call
+    stopped, across lines; readline() then returns the rest of the current
+    line, if only part of it was consumed.
+    """
+    def __init__(self, f):
+        """ Reads the whole of the given file. """
+        self.name = getattr(f, 'name', None)
+        # Each line keeps its newline, so that readline() can return it as is.
+        self._lines = f.read().splitlines(True)
+        if self._lines and not self._lines[-1].endswith('\n'):
+            self._lines[-1] += '\n'
+        self._line_no = 0
+        self._pending = [] # The unconsumed tokens of a partial line.
+        self._pos = 0
+
+    def readline(self):
+        """ Returns the next line, or the rest of the current one, with a
+        trailing newline; returns an empty string at the end of the file.
+        """
+        if self._pos < len(self._pending):
+            line = ' '.join(self._pending[self._pos:])
+            self._pending = []
+            self._pos = 0
+            return line + '\n'
+        line_no = self._line_no
+        if line_no < len(self._lines):
+            self._line_no = line_no + 1
+            return self._lines[line_no]
+        return ''
+
+    def __iter__(self):
+        """ Iterates over the remaining lines, as a file does. """
+        return self
+
+    def __next__(self):
+        """ Returns the next line, as for readline(); raises StopIteration
+        at the end of the file.
+        """
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+    next = __next__
+
+    def readlines(self):
+        """ Returns a list of the remaining lines. """
+        return list(self)
+
+    def read(self):
+        """ Returns the rest of the file. """
+        return ''.join(self)
+
+    def _next_line(self):
+        """ Returns the next line, or None at the end of the file. """
+        if self._line_no >= len(self._lines):
+            return None
+        self._line_no += 1
+        return self._lines[self._line_no - 1]
+
+    def tell(self):
+        """ Returns the current position, as a JSON-serializable state
+        that seek() accepts.
+        """
+        return [self._line_no, self._pending[self._pos:]]
+
+    def seek(self, state):
+        """ Returns to a position given by tell(). """
+        self._line_no, self._pending = state[0], list(state[1])
+        self._pos = 0
+
+    def _take(self, n):
+        """ Returns a list of the next n tokens. """
+        pending, pos = self._pending, self._pos
+        if pos + n <= len(pending):
+            self._pos = pos + n
+            return pending[pos:pos+n]
+        tokens = pending[pos:]
+        while len(tokens) < n:
+            line = self._next_line()
+            if line is None:
+                raise EOFError("Expected {} more tokens".format(
+                    n - len(tokens)))
+            tokens.extend(line.split())
+        self._pending = tokens
+        self._pos = n
+        return tokens[:n]
+
+    def token(self):
+        """ Returns the next token, as a string. """
+        pos = self._pos
+        if pos < len(self._pending):
+            self._pos = pos + 1
+            return self._pending[pos]
+        return self._take(1)[0]
+
+    def int(self):
+        """ Returns the next token, as an int. """
+        return int(self.token())
+
+    def float(self):
+        """ Returns the next token, as a float. """
+        return float(self.token())
+
+    def ints(self, n):
+        """ Returns a list of the next n tokens, as ints. """
+        return [int(t) for t in self._take(n)]
+
+    def floats(self, n):
+        """ Returns a list of the next n tokens, as floats. """
+        return [float(t) for t in self._take(n)]
+
+    def array(self, shape, dtype=None):
+        """ Returns a numpy array of the given shape (or length), and of the
+        given dtype (by default, int64), filled with the next tokens in
+        row-major order; e.g. array((r, c)) reads a whole integer matrix.
+
+        Numeric arrays are parsed by numpy straight from the text of the
+        lines, without splitting them into tokens first; any lines that it
+        cannot parse exactly (e.g. because they go on to hold words, or
+        integers too big for the dtype) are split into tokens as usual.
+        Input after the array is left unread, whatever it holds:
+
+        >>> for after in ['abc', '1.5', str(2**64)]:
+        ...     f = TokenReader(StringIO('1\\n2 3 4\\n' + after + '\\n'))
+        ...     print(f.array(4), f.readline().split())
+        [1 2 3 4] ['abc']
+        [1 2 3 4] ['1.5']
+        [1 2 3 4] ['18446744073709551616']
+        """
+        import numpy as np
+        if dtype is None:
+            dtype = np.int64
+        shape = tuple(np.atleast_1d(shape))
+        size = int(np.prod(shape))
+        if np.dtype(dtype).kind not in 'biuf':
+            return np.array(self._take(size), dtype=dtype).reshape(shape)
+        head = self._pending[self._pos:self._pos+size]
+        self._pos += len(head)
+        chunks = [np.array(head, dtype=dtype)]
+        needed = size - len(head)
+        num_lines = 1
+        while needed > 0:
+            start = self._line_no
+            stop = min(start + num_lines, len(self._lines))
+            if start == stop:
+                raise EOFError("Expected {} more tokens".format(needed))
+            values = _parse_numbers(''.join(self._lines[start:stop]), dtype)
+            if values is None:
+                chunks.append(np.array(self._take(needed), dtype=dtype))
+                break
+            self._line_no = stop
+            if len(values) >= needed:
+                self._unread(len(values) - needed)
+                values = values[:needed]
+            chunks.append(values)
+            needed -= len(values)
+            # Guess how many more lines are needed from those read so far;
+            # rounding down means that rows of equal length are never read
+            # past.
+            num_lines = max(needed * (stop - start) // max(len(values), 1), 1)
+        return np.concatenate(chunks).reshape(shape)
+
+    def _unread(self, count):
+        """ Steps back over the last count tokens of the lines read so far,
+        and any blank lines after them, leaving any partly read line as the
+        current one.
+        """
+        while True:
+            self._line_no -= 1
+            tokens = self._lines[self._line_no].split()
+            if len(tokens) > count:
+                break
+            count -= len(tokens)
+        self._line_no += 1
+        self._pending = tokens if count else []
+        self._pos = len(tokens) - count if count else 0
+
+def _parse_numbers(text, dtype):
+    """ Parses whitespace-separated numbers with numpy, returning None if
+    the text holds anything else, or integers out of the dtype's range.
+    """
+    import warnings
+    import numpy as np
+    if text.isspace() or not text: # Parsed as [0] by numpy.
+        return np.zeros(0, dtype=dtype)
+    with warnings.catch_warnings():
+        # Older versions of numpy only warn about unparsed text.
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(text, dtype=dtype, sep=' ')
+        except (ValueError, DeprecationWarning):
+            return None
+    if values.dtype.kind in 'iu' and len(values):
+        # Too big integers are clamped to the limits of the dtype.
+        info = np.iinfo(values.dtype)
+        if values.max() == info.max or values.min() == info.min:
+            return None
+    return values
+
+class JudgeConnection(TokenReader):
+    """ A connection to an interactive judge, which acts as both the input
+    and the output file of a solver, with the same helpers for reading as
+    a TokenReader.
+
+    Writes are buffered, and are only sent when flush() is called, or
+    automatically before reading (so that forgetting to flush cannot
+    deadlock the solver); send(*values) writes a line and flushes it.
+
+    Each reply that follows a flush counts as a query, and the time from
+    the flush to the reply is its round-trip latency; queries, wait_time
+    and max_latency hold the totals so far. The latency includes any work
+    that the solver does between the flush and the read, so it is only
+    the judge's own when the solver reads the reply straight after sending
+    the query.
+    """
+    def __init__(self, f_in, f_out):
+        """ Connects to a judge that writes to f_in and reads from f_out. """
+        self.name = getattr(f_in, 'name', None)
+        self._in = f_in
+        self._out = f_out
+        self._pending = []
+        self._pos = 0
+        self._unflushed = False
+        self._sent_at = None
+        self.queries = 0
+        self.wait_time = 0.0
+        self.max_latency = 0.0
+
+    def write(self, data):
+        """ Buffers the given data, to be sent to the judge. """
+        self._out.write(data)
+        self._unflushed = True
+
+    def flush(self):
+        """ Sends any buffered data to the judge. """
+        if self._unflushed:
+            self._out.flush()
+            self._unflushed = False
+            self._sent_at = time.time()
+
+    def send(self, *values):
+        """ Sends the given values to the judge as a line. """
+        self.write(' '.join(str(v) for v in values) + '\n')
+        self.flush()
+
+    def array(self, shape, dtype=None):
+        """ Returns a numpy array of the next tokens, as for
+        TokenReader.array(), but splits them from the judge's lines one by
+        one, as reading any further ahead would wait on the judge.
+
+        >>> judge = JudgeConnection(StringIO('1 2\\n3 4\\n5\\n'), StringIO())
+        >>> judge.array((2, 2)).tolist(), judge.readline()
+        ([[1, 2], [3, 4]], '5\\n')
+        """
+        import numpy as np
+        if dtype is None:
+            dtype = np.int64
+        shape = tuple(np.atleast_1d(shape))
+        size = int(np.prod(shape))
+        return np.array(self._take(size), dtype=dtype).reshape(shape)
+
+    def readline(self):
+        """ Returns the next line from the judge, or the rest of the
+        current one, as TokenReader.readline() does.
+        """
+        if self._pos < len(self._pending):
+            return TokenReader.readline(self)
+        line = self._next_line()
+        return '' if line is None else line + '\n'
+
+    def _next_line(self):
+        """ Flushes, and then waits for the next line from the judge. """
+        self.flush()
+        line = self._in.readline()
+        if self._sent_at is not None:
+            latency = time.time() - self._sent_at
+            self._sent_at = None
+            self.queries += 1
+            self.wait_time += latency
+            self.max_latency = max(self.max_latency, latency)
+        return line.rstrip('\r\n') if line else None
+
+def process_interactive(pfun, p0=lambda f:(int(f.readline()), None),
+                        argv=None):
+    """ Solves an interactive Code Jam problem, with the same functions as
+    process_input, except that pfun is given a JudgeConnection as both its
+    input and its output file.
+
+    The command-line arguments, after any options, are a command to run
+    a local judge, which is then connected to the solver via pipes, e.g.
+        python solution.py -t python judge.py 0
+    Without them, the solver talks to the real judge via stdin and stdout.
+
+    For a local judge, or with the -t option, the number of queries and
+    the round-trip latencies of each case are printed to stderr at the end,
+    along with the judge's exit code.
+    """
+    if not argv:
+        argv = sys.argv[1:]
+    options = {}
+    while argv and argv[0].startswith("-"):
+        options.update(_parse_options(argv.pop(0)[1:]))
+
+    judge = None
+    if argv:
+        import subprocess
+        judge = subprocess.Popen(argv, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 universal_newlines=True)
+        conn = JudgeConnection(judge.stdout, judge.stdin)
+    else:
+        conn = JudgeConnection(sys.stdin, sys.stdout)
+
+    stats = []
+    try:
+        num_cases, other_data = p0(conn)
+        for case_no in range(1, num_cases+1):
+            queries, wait_time = conn.queries, conn.wait_time
+            conn.max_latency = 0.0
+            start = time.time()
+            pfun(conn, conn, case_no, other_data)
+            conn.flush()
+            # Any reply to the case's last write belongs to the next case.
+            conn._sent_at = None
+            stats.append((case_no, time.time() - start,
+                          conn.queries - queries, conn.wait_time - wait_time,
+                          conn.max_latency))
+    except BaseException:
+        # The judge may be blocked writing to us, so it would never exit.
+        if judge is not None:
+            judge.kill()
+        raise
+    finally:
+        if judge is not None:
+            try:
+                judge.stdin.close()
+            except (IOError, OSError): # The judge has already gone.
+                pass
+            judge.stdout.close()
+            code = judge.wait()
+    if judge is not None or "t" in options:
+        print_interactive_stats(stats)
+    if judge is not None:
+        print("Judge exited with code {}".format(code), file=sys.stderr)
+
+def print_interactive_stats(stats, f=sys.stderr):
+    """ Prints the time, query count and latencies of each interactive
+    case, as recorded by process_interactive.
+    """
+    print(file=f)
+    for case_no, elapsed, queries, wait_time, max_latency in stats:
+        mean = wait_time / queries if queries else 0.0
+        print("Case #{}: {:.3f}s, {} queries, {:.3f} ms mean and {:.3f} ms "
+              "max latency".format(case_no, elapsed, queries, 1000 * mean,
+                                   1000 * max_latency), file=f)
+    print("Total: {} queries in {:.3f}s".format(
+        sum(s[2] for s in stats), sum(s[1] for s in stats)), file=f)
+
 def process_input(pfun, p0=lambda f:(int(f.readline()), None),
-        module_path=None, argv=None):
+        module_path=None, argv=None, read_case=None, parallel=None,
+        fast_input=True):
     """ Processes a single Code Jam input file with some command-line tools.
 
     The arguments are two functions; - the first (pfun) takes
@@ -46,6 +443,20 @@ def process_input(pfun, p0=lambda f:(int(f.readline()), None),
     the number of cases and any additional data that is needed; this
     data is passed onto pfun via its fourth argument.
 
+    If read_case is given, parsing is separated from solving; read_case
+    takes the input file, the case number and the other data, and returns
+    the data for that case, which is then passed to pfun in place of
+    the input file. This is required for parallel mode, in which the cases
+    are all read up front and then solved by a pool of processes; parallel
+    may be True (one process per CPU) or a number of processes. The output
+    is still written in case order.
+
+    If fast_input is True, the input file is read in bulk, and a
+    TokenReader is passed to p0, pfun and read_case in place of the file;
+    it supports readline() and iteration, so existing functions still work
+    (though a Python-level readline() is a little slower than a real
+    file's), but it also offers much faster typed token helpers.
+
     The command-line options are simple - a single input file is expected,
     defaulting to test.in if no file is given. By default, the output
     simply goes to stdout, but this is modified by two options:
@@ -55,59 +466,405 @@ def process_input(pfun, p0=lambda f:(int(f.readline()), None),
         -c    If -d was selected, the output will be copied to stdout as well
                 as to the file.
         -n    Don't update the source code archive.
+        -p    Solve the cases in parallel, with one process per CPU, or e.g.
+                with four processes for -p4.
+    There are also options for finding slow cases and hot spots:
+        -t    Time each case, and print the slowest cases to stderr.
+        -m    As for -t, but also record the peak memory use of each case
+                (with tracemalloc, which slows the run down).
+        -r    Profile the whole run with cProfile, writing the stats to
+                a file named like the output file, but ending in ".prof";
+                e.g. -r3 profiles only case #3. This disables -p.
+    Finally, for long runs:
+        -j    Keep a journal of the finished cases (see Journal), so that if
+                the run is killed, rerunning it skips them. This requires
+                fast_input or read_case.
     """
     if not argv:
         argv = sys.argv[1:]
 
-    options = set()
-    for arg in argv:
+    options = {}
+    for arg in list(argv):
         if arg.startswith("-"):
             argv.remove(arg)
-            options.update(arg[1:])
+            options.update(_parse_options(arg[1:]))
     filename = argv[0] if argv else 'test.in'
 
+    root, ext = os.path.splitext(filename)
+    if ext == '.out':
+        root += '.out'
     targets = []
     if "d" in options:
-        root, ext = os.path.splitext(filename)
-        if ext == '.out':
-            root += '.out'
         targets.append(open(root + '.out', 'w'))
     if not targets or "c" in options:
         targets.append(sys.stdout)
     if "n" in options:
         module_path = None
-    f_out = MultiOutput(targets)
+    if "p" in options and not parallel:
+        parallel = options["p"] or True
+    profile = "r" in options
+    profile_case = options.get("r")
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        parallel = None
+    if parallel and read_case is None:
+        raise ValueError("Parallel mode requires a read_case function.")
+    journal = None
+    if "j" in options:
+        if not fast_input and read_case is None:
+            raise ValueError("A journal requires fast_input or read_case.")
+        journal = Journal(root + '.journal', filename)
+    memory = "m" in options
+    stats = [] if memory or "t" in options else None
+    f_out = MultiOutput(targets, buffered=True)
+    archiver = None
+    if module_path is not None:
+        # Archive the modules loaded so far while the cases are being
+        # solved; any imported during solving are added afterwards.
+        archiver = make_archive(module_path, background=True)
 
     with open(filename) as f_in:
+        if fast_input:
+            f_in = TokenReader(f_in)
+        if profile and profile_case is None:
+            profiler.enable()
         num_cases, other_data = p0(f_in)
-        for case_no in range(1, num_cases+1):
-            pfun(f_in, f_out, case_no, other_data)
+        done = journal.load() if journal is not None else {}
+        if parallel:
+            solve_parallel(pfun, read_case, f_in, f_out, num_cases,
+                           other_data, None if parallel is True else parallel,
+                           stats, memory, journal, done)
+        else:
+            for case_no in range(1, num_cases+1):
+                if case_no in done:
+                    output, state = done[case_no]
+                    if read_case is not None:
+                        read_case(f_in, case_no, other_data)
+                    else:
+                        f_in.seek(state)
+                    f_out.write(output)
+                    f_out.flush()
+                    continue
+                case_in = f_in
+                if read_case is not None:
+                    case_in = read_case(f_in, case_no, other_data)
+                case_out = f_out if journal is None else StringIO()
+                if profile and case_no == profile_case:
+                    profiler.enable()
+                with CaseTimer(case_no, stats, memory):
+                    pfun(case_in, case_out, case_no, other_data)
+                if profile and case_no == profile_case:
+                    profiler.disable()
+                if journal is not None:
+                    output = case_out.getvalue()
+                    f_out.write(output)
+                    journal.record(case_no, output,
+                                   f_in.tell() if fast_input else None)
+                f_out.flush()
+        if profile:
+            profiler.disable()
     f_out.close()
+    if journal is not None:
+        journal.finish()
 
-    if module_path is not None:
-        make_archive(module_path)
+    if profile:
+        profiler.dump_stats(root + '.prof')
+        print("Profile written to {}".format(root + '.prof'), file=sys.stderr)
+    if stats is not None:
+        print_case_stats(stats)
+    if archiver is not None:
+        archiver.join()
+        if source_paths(module_path) != archiver.paths:
+            # Modules were imported while solving; archive them too.
+            make_archive(module_path)
+
+def _parse_options(letters):
+    """ Parses a group of single-letter options, each of which may be
+    followed by a number, e.g. "dcr3"; returns a dictionary mapping each
+    letter to its number, or None.
+    """
+    options = {}
+    letter = None
+    digits = ''
+    for c in letters + ' ':
+        if c.isdigit() and letter is not None:
+            digits += c
+            continue
+        if letter is not None:
+            options[letter] = int(digits) if digits else None
+        letter = c
+        digits = ''
+    return options
+
+class CaseTimer(object):
+    """ A context manager that records the wall time (and optionally the
+    peak memory use, via tracemalloc) of solving a case, by appending
+    a tuple (seconds, peak bytes or None, case number) to stats; if stats
+    is None, it does nothing.
+    """
+    def __init__(self, case_no, stats, memory=False):
+        self.case_no = case_no
+        self.stats = stats
+        self.memory = memory and stats is not None
+
+    def __enter__(self):
+        if self.memory:
+            import tracemalloc
+            tracemalloc.start()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.stats is None:
+            return
+        elapsed = time.time() - self.start
+        peak = None
+        if self.memory:
+            import tracemalloc
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.stats.append((elapsed, peak, self.case_no))
+
+def print_case_stats(stats, count=5, f=sys.stderr):
+    """ Prints the total time of the recorded cases, and the slowest few of
+    them, with their peak memory use if it was recorded.
+    """
+    print(file=f)
+    print("{} cases in {:.3f}s; slowest:".format(
+        len(stats), sum(s[0] for s in stats)), file=f)
+    for elapsed, peak, case_no in sorted(stats, reverse=True)[:count]:
+        line = "  Case #{}: {:.3f}s".format(case_no, elapsed)
+        if peak is not None:
+            line += ", {:.1f} MB peak".format(peak / 2**20)
+        print(line, file=f)
+
+def solve_parallel(pfun, read_case, f_in, f_out, num_cases, other_data,
+                   processes=None, stats=None, memory=False, journal=None,
+                   done={}):
+    """ Reads every case from f_in, and then solves them with a pool of
+    the given number of processes (by default, one per CPU).
+
+    The output of each case is collected in its worker and written to f_out
+    in case order, as soon as all of the earlier cases are done.
+    pfun must be picklable, i.e. defined at the top level of its module.
+    If stats is a list, each case is timed as for CaseTimer. Cases in done
+    (as loaded from a Journal) are not solved again, and the new ones are
+    recorded in the journal, if one is given.
+
+    Anything raised by pfun, even SystemExit, is raised again here, and if
+    a worker process dies (e.g. by os._exit, a crash or the OOM killer),
+    a BrokenProcessPool is raised; either way the other workers are killed.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    timed = stats is not None
+    tasks = []
+    for case_no in range(1, num_cases+1):
+        case_data = read_case(f_in, case_no, other_data)
+        if case_no not in done:
+            tasks.append((case_data, case_no))
+    # pfun and other_data go to each worker once, not with every case.
+    executor = ProcessPoolExecutor(processes, initializer=_init_worker,
+                                   initargs=(pfun, other_data, timed, memory))
+    try:
+        results = [executor.submit(_solve_case, task) for task in tasks]
+        results.reverse()
+        for case_no in range(1, num_cases+1):
+            if case_no in done:
+                f_out.write(done[case_no][0])
+                f_out.flush()
+                continue
+            output, case_stats, error = results.pop().result()
+            if error is not None:
+                raise error
+            f_out.write(output)
+            f_out.flush()
+            if timed:
+                stats.extend(case_stats)
+            if journal is not None:
+                journal.record(case_no, output, None)
+    except BaseException:
+        # The executor can't stop running cases, so kill its workers.
+        for process in list(executor._processes.values()):
+            process.terminate()
+        raise
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+_worker_state = None # (pfun, other_data, timed, memory) in each worker.
+
+def _init_worker(*state):
+    """ Stores the data shared by every case within a worker process. """
+    global _worker_state
+    _worker_state = state
+
+def _solve_case(task):
+    """ Solves a single case within a worker process, returning its output
+    as a string, its timing statistics, and whatever pfun raised, if
+    anything (after printing its traceback), or None.
+    """
+    pfun, other_data, timed, memory = _worker_state
+    case_data, case_no = task
+    buf = StringIO()
+    stats = [] if timed else None
+    try:
+        with CaseTimer(case_no, stats, memory):
+            pfun(case_data, buf, case_no, other_data)
+    except BaseException as e:
+        import traceback
+        traceback.print_exc()
+        return None, None, e
+    return buf.getvalue(), stats, None
+
+class Journal(object):
+    """ A journal of the finished cases of a run, for resuming it.
+
+    Each finished case is appended to the journal file as a line of JSON
+    holding its output and the position of the input after it, and the
+    file is flushed, so that it survives the process being killed. The
+    first line identifies the input file by its size and modification
+    time; if these do not match, the journal is started afresh.
 
-def make_archive(module_path):
-    paths = set()
-    target = os.path.join(os.path.split(module_path)[0], "src.zip")
-    paths.add(os.path.realpath(module_path))
-    for module_name in sys.modules:
+    The journal is deleted by finish(), once the whole run has succeeded.
+    """
+    def __init__(self, path, input_path):
+        """ Creates a journal at path, for the given input file. """
+        self.path = path
+        info = os.stat(input_path)
+        self.header = {'input': [info.st_size, info.st_mtime]}
+        self._file = None
+
+    def load(self):
+        """ Returns a dictionary mapping the number of each finished case
+        to its output and input position, and opens the journal for
+        appending new cases.
+        """
+        import json
+        done = {}
         try:
-            path = inspect.getsourcefile(sys.modules[module_name])
-            if path.startswith(os.environ['GOOGLE_DRIVE']):
-                paths.add(path)
-        except (TypeError, AttributeError):
-            pass
-    print(file=sys.stderr)
+            with open(self.path) as f:
+                lines = f.read().split('\n')
+        except (IOError, OSError):
+            lines = []
+        valid = 0
+        if lines and _load_json(lines[0]) == self.header:
+            for line in lines[1:]:
+                entry = _load_json(line)
+                if entry is None:
+                    break # Cut short by a crash.
+                done[entry['case']] = (entry['output'], entry['pos'])
+                valid += 1
+        if done:
+            print("Resuming after {} finished cases from {}".format(
+                len(done), self.path), file=sys.stderr)
+        # Rewrite the journal without any partial line.
+        self._file = open(self.path, 'w')
+        self._file.write(json.dumps(self.header) + '\n')
+        for line in lines[1:valid+1]:
+            self._file.write(line + '\n')
+        self._file.flush()
+        return done
+
+    def record(self, case_no, output, pos):
+        """ Records a finished case. """
+        import json
+        entry = {'case': case_no, 'output': output, 'pos': pos}
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+    def finish(self):
+        """ Closes and deletes the journal. """
+        self._file.close()
+        os.remove(self.path)
+
+def _load_json(line):
+    """ Parses a line of JSON, returning None if it is invalid. """
+    import json
     try:
-        os.remove(target)
-        print("Deleted {} - remaking".format(target), file=sys.stderr)
-    except OSError:
-        pass
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def make_archive(module_path, root=None, background=False):
+    """ Archives the source code of a solution into src.zip, alongside it.
 
-    archive = zipfile.ZipFile(target, 'w')
+    The archive holds the solution module itself, and every other loaded
+    module whose source lies under root; by default, root is taken from
+    the GOOGLE_DRIVE environment variable, or failing that, is the folder
+    containing this library.
+
+    A hash of the sources is stored as the archive's comment, so that the
+    archive is only rewritten if something has changed. If background is
+    True, the archive is made in a new thread, which is returned; it should
+    be joined before exiting; its paths attribute lists the archived files,
+    as for source_paths.
+    """
+    paths = source_paths(module_path, root)
+    target = os.path.join(os.path.dirname(os.path.abspath(module_path)),
+                          "src.zip")
+    if not background:
+        return _write_archive(target, paths)
+    import threading
+    thread = threading.Thread(target=_write_archive, args=(target, paths))
+    thread.paths = paths
+    thread.start()
+    return thread
+
+def source_paths(module_path, root=None):
+    """ Returns the sorted list of source files that make_archive archives
+    for the given solution module, from the modules loaded so far.
+    """
+    if root is None:
+        root = os.environ.get('GOOGLE_DRIVE',
+                              os.path.dirname(os.path.abspath(__file__)))
+    root = os.path.realpath(root)
+    paths = set([os.path.realpath(module_path)])
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        if path.endswith(('.pyc', '.pyo')):
+            path = path[:-1]
+        path = os.path.realpath(path)
+        if path.startswith(root + os.sep) and path.endswith('.py'):
+            paths.add(path)
+    return sorted(paths)
+
+def _write_archive(target, paths):
+    """ Writes the given files into the zip archive target, unless it
+    already holds exactly the same files.
+    """
+    import hashlib
+    import zipfile
+    digest = hashlib.sha1()
+    sources = []
     for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            continue
         filename = os.path.basename(path)
-        archive.write(path, filename)
-        print("Added {}".format(filename), file=sys.stderr)
-    archive.close()
+        sources.append((filename, data))
+        digest.update(filename.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha1(data).digest())
+    comment = digest.hexdigest().encode('ascii')
+    try:
+        with zipfile.ZipFile(target) as archive:
+            if archive.comment == comment:
+                return
+    except (IOError, OSError, zipfile.BadZipfile):
+        pass
+
+    temp = target + '.tmp'
+    with zipfile.ZipFile(temp, 'w') as archive:
+        for filename, data in sources:
+            archive.writestr(filename, data)
+        archive.comment = comment
+    if os.path.exists(target):
+        os.remove(target)
+    os.rename(temp, target)
+    print(file=sys.stderr)
+    print("Archived {} into {}".format(
+        ', '.join(filename for filename, _ in sources), target),
+        file=sys.stderr)
@@ -1,11 +1,16 @@
 """ Some combinatorics functions. """
 from __future__ import division, print_function
-import gmpy2
+import array
+import collections
+import lazy
+np = lazy.LazyModule('numpy')
+gmpy2 = lazy.LazyModule('gmpy2')
 
 def modulo_combs(m, n, p):
     """ Uses Lucas' theorem to calculate the value of m choose n, modulo p. 
     For this to work p must be a prime - the output is indeterminate for
-    non-prime values of p.
+    non-prime values of p. For many queries modulo the same p, use
+    BinomialMod instead.
     """
     product = 1
     while m > 0:
@@ -16,20 +21,272 @@ def modulo_combs(m, n, p):
             return 0
     return product
 
+class BinomialMod(object):
+    """ Computes binomial coefficients modulo a prime p, using tables of
+    the factorials and inverse factorials modulo p below the given limit
+    (by default, all of them, i.e. up to p), which are computed once.
+
+    Queries with n below the limit take O(1) time; larger ones use Lucas'
+    theorem, taking O(log_p(n)) time, which requires each base-p digit of
+    n to be below the limit (a ValueError is raised if not). Hence for a
+    small p there is no need for a limit, while a large p such as 10**9+7
+    needs one, e.g. the largest n in the input; a ValueError is raised if
+    p exceeds MAX_TABLE and no limit is given.
+
+    Instances are called as binomial(n, k), or, for arrays of queries,
+    binomial.batch(ns, ks), which is vectorized with numpy; this requires
+    p*p < 2**63.
+    """
+    MAX_TABLE = 10**7 # The largest table built without an explicit limit.
+
+    def __init__(self, p, limit=None):
+        if limit is None and p > self.MAX_TABLE:
+            raise ValueError("A limit is needed for p > {}.".format(
+                self.MAX_TABLE))
+        self.p = p
+        self.size = size = p if limit is None else max(1, min(p, limit))
+        # The tables are int64 arrays, which take 8 bytes per entry; large
+        # ones are built with numpy, where the products fit in an int64.
+        if size > 2**12 and p*p < 2**63:
+            # fact[i] is the product of 1, ..., i, and inv_fact[size-1-i]
+            # is inv_fact[size-1] times the product of size-1, ..., size-i,
+            # so both are prefix products.
+            factors = np.arange(size, dtype=np.int64)
+            factors[0] = 1
+            self.fact = _int64_array(_prefix_products(factors, p))
+            np.subtract(size, factors, out=factors)
+            factors[0] = 1
+            inv_fact = _prefix_products(factors, p)
+            del factors
+            inv_fact *= pow(self.fact[-1], p-2, p)
+            inv_fact %= p
+            self.inv_fact = _int64_array(inv_fact)
+            self.inv_fact.reverse()
+        else:
+            self.fact = array.array('q', [1]) * size
+            for i in range(1, size):
+                self.fact[i] = self.fact[i-1] * i % p
+            self.inv_fact = array.array('q', [1]) * size
+            self.inv_fact[-1] = pow(self.fact[-1], p-2, p)
+            for i in range(size-1, 1, -1):
+                self.inv_fact[i-1] = self.inv_fact[i] * i % p
+
+    def __call__(self, n, k):
+        """ Returns n choose k, modulo p. """
+        if k < 0 or k > n:
+            return 0
+        p = self.p
+        fact, inv_fact = self.fact, self.inv_fact
+        if n < self.size:
+            return fact[n] * inv_fact[k] % p * inv_fact[n-k] % p
+        product = 1
+        while n:
+            n, ni = divmod(n, p)
+            k, ki = divmod(k, p)
+            if ki > ni:
+                return 0
+            if ni >= self.size:
+                raise ValueError("Digit {} is beyond the table limit {}"
+                                 .format(ni, self.size))
+            product = (product * fact[ni] % p * inv_fact[ki] % p *
+                       inv_fact[ni-ki] % p)
+        return product
+
+    def batch(self, ns, ks):
+        """ Returns an int64 numpy array of ns[i] choose ks[i], modulo p,
+        for arrays of non-negative ns and ks.
+        """
+        fact = np.frombuffer(self.fact, dtype=np.int64)
+        inv_fact = np.frombuffer(self.inv_fact, dtype=np.int64)
+        p = self.p
+        ns, ks = np.broadcast_arrays(np.asarray(ns, dtype=np.int64),
+                                     np.asarray(ks, dtype=np.int64))
+        result = ((ks >= 0) & (ks <= ns)).astype(np.int64)
+        ns = ns.copy()
+        ks = np.where(result, ks, 0)
+        while True:
+            live = np.flatnonzero((ns > 0) & (result > 0))
+            if not len(live):
+                return result
+            n, ni = np.divmod(ns[live], p)
+            k, ki = np.divmod(ks[live], p)
+            ns[live] = n
+            ks[live] = k
+            if ni.max() >= self.size:
+                raise ValueError("Digit {} is beyond the table limit {}"
+                                 .format(ni.max(), self.size))
+            zero = ki > ni
+            ki[zero] = 0
+            terms = fact[ni] * inv_fact[ki] % p * inv_fact[ni-ki] % p
+            terms[zero] = 0
+            result[live] = result[live] * terms % p
+
+def _prefix_products(values, p):
+    """ Returns the products of the prefixes of an int64 array, modulo p,
+    for p*p < 2**63; the work is vectorized over blocks of about sqrt(n)
+    values, which are then joined by their running products.
+    """
+    n = len(values)
+    width = int(n**0.5) + 1
+    padded = np.ones(-(-n // width) * width, dtype=np.int64)
+    np.remainder(values, p, out=padded[:n])
+    blocks = padded.reshape(-1, width) # One block per row.
+    for i in range(1, width):
+        column = blocks[:, i]
+        np.multiply(blocks[:, i-1], column, out=column)
+        np.remainder(column, p, out=column)
+    offsets = [1]
+    for last in blocks[:-1, -1].tolist():
+        offsets.append(offsets[-1] * last % p)
+    blocks *= np.array(offsets, dtype=np.int64)[:, None]
+    blocks %= p
+    return padded[:n]
+
+def _int64_array(values):
+    """ Copies a numpy int64 array into an array.array('q'). """
+    result = array.array('q')
+    result.frombytes(memoryview(np.ascontiguousarray(values)).cast('B'))
+    return result
+
 def visit_subsets(s, ls=None, fun=lambda s: (print(s), False)[1]):
-    """ Recursively visit subsets of s, applying fun.
-    If fun returns True for any set, its subsets will not be visited,
-    unless they were already visited as subsets of an earlier set.
+    """ Visit subsets of s, applying fun, visiting every set before any of
+    its subsets. If fun returns True for any set, none of its subsets will
+    be visited; ls optionally gives the order of the elements of s.
+
+    This is a wrapper around visit_submasks, passing frozensets to fun.
     """
-    s = frozenset(s)
-    if ls is None:
-        ls = list(s)
+    elements = list(s) if ls is None else list(ls)
+    visit_submasks(len(elements),
+                   lambda mask: fun(frozenset(from_mask(mask, elements))))
 
-    if fun(s) or not(s):
+def to_mask(subset, elements):
+    """ Returns the bitmask of the given subset of the sequence of elements,
+    in which bit i is set when elements[i] is in the subset.
+    """
+    index = dict((x, i) for i, x in enumerate(elements))
+    mask = 0
+    for x in subset:
+        mask |= 1 << index[x]
+    return mask
+
+def from_mask(mask, elements):
+    """ Returns the list of the elements whose bits are set in mask. """
+    subset = []
+    while mask:
+        low = mask & -mask
+        subset.append(elements[low.bit_length() - 1])
+        mask ^= low
+    return subset
+
+def submasks(mask):
+    """ Yields every submask of mask, in decreasing order, ending with 0;
+    there are 2**popcount(mask) of them.
+    """
+    sub = mask
+    while sub:
+        yield sub
+        sub = (sub - 1) & mask
+    yield 0
+
+def gray_code(n):
+    """ Yields the 2**n bitmasks over n bits in Gray code order, starting
+    with 0, as pairs (mask, bit), where bit is the index of the one bit
+    that differs from the previous mask (None for the first mask). Hence
+    a value over subsets can be updated by adding or removing one element
+    at each step.
+    """
+    mask = 0
+    yield mask, None
+    for i in range(1, 1 << n):
+        bit = (i & -i).bit_length() - 1
+        mask ^= 1 << bit
+        yield mask, bit
+
+def gray_code_array(n):
+    """ Returns a numpy array of the 2**n bitmasks over n bits in Gray
+    code order.
+    """
+    i = np.arange(1 << n, dtype=np.int64)
+    return i ^ (i >> 1)
+
+def visit_submasks(n, fun):
+    """ Visits the bitmasks over n bits, applying fun to each, with every
+    mask visited before any of its submasks, i.e. level by level, in order
+    of decreasing popcount. If fun returns True for a mask, none of its
+    submasks are visited at all.
+
+    Only the masks that are visited cost anything - O(n) each - so a search
+    that prunes heavily stops early. A mask is reached once all of the
+    masks with one more bit have been visited without pruning, which is
+    tracked in a table of 2**n bytes; hence n up to 25 or so is practical.
+    """
+    full = (1 << n) - 1
+    if fun(full) or not full:
         return
+    parents = bytearray(1 << n) # The unpruned parents seen for each mask.
+    level = [full]
+    need = 0 # The number of parents of the masks in the next level.
+    while level:
+        need += 1
+        next_level = []
+        for mask in level:
+            rest = mask
+            while rest:
+                low = rest & -rest
+                sub = mask ^ low
+                count = parents[sub] + 1
+                parents[sub] = count
+                if count == need:
+                    next_level.append(sub)
+                rest ^= low
+        level = [mask for mask in next_level if not fun(mask)]
 
-    for i in range(len(ls)):
-        result = visit_subsets(s-{ls[i]}, ls[i+1:], fun=fun)
+def popcounts(n):
+    """ Returns a numpy array of the number of bits set in each of the
+    2**n bitmasks over n bits.
+    """
+    counts = np.zeros(1 << n, dtype=np.int8)
+    for i in range(n):
+        counts[1 << i:2 << i] = counts[:1 << i] + 1
+    return counts
+
+def zeta_transform(values, superset=False, op=None):
+    """ Returns the sum over subsets (SOS) of an array of 2**n values
+    indexed by bitmask, i.e. the array whose entry for each mask is the sum
+    of the values of its submasks (or of its supermasks, if superset is
+    True). Another ufunc than np.add may be given as op, e.g. np.maximum.
+    Takes O(n 2**n) time, vectorized along each bit.
+    """
+    if op is None:
+        op = np.add
+    result = np.array(values)
+    n = len(result).bit_length() - 1
+    if len(result) != 1 << n:
+        raise ValueError("The number of values must be a power of 2.")
+    for i in range(n):
+        pairs = result.reshape(-1, 2, 1 << i)
+        if superset:
+            op(pairs[:, 0], pairs[:, 1], out=pairs[:, 0])
+        else:
+            op(pairs[:, 1], pairs[:, 0], out=pairs[:, 1])
+    return result
+
+def mobius_transform(values, superset=False):
+    """ Returns the inverse of zeta_transform (with op=np.add), so that
+    mobius_transform(zeta_transform(a)) == a; e.g. this recovers the
+    values of exact sets from sums over subsets.
+    """
+    result = np.array(values)
+    n = len(result).bit_length() - 1
+    if len(result) != 1 << n:
+        raise ValueError("The number of values must be a power of 2.")
+    for i in range(n):
+        pairs = result.reshape(-1, 2, 1 << i)
+        if superset:
+            pairs[:, 0] -= pairs[:, 1]
+        else:
+            pairs[:, 1] -= pairs[:, 0]
+    return result
 
 
 def reverse(seq, start, end):
@@ -46,55 +303,197 @@ def reverse(seq, start, end):
         start += 1
         end -= 1
 
-def multiset_permutations_from(seq, key=lambda x: x):
+def multiset_permutations_from(seq, key=None, copy=True):
     """ Returns a generator that yields unique permutations of seq that 
     are equal to or greater than seq in lexicographical order, based on
-    the ordering key given.
+    the ordering key given (by default, the items themselves).
 
     Note that this behaviour means that the sequence itself is always the
     first item to be yielded.
 
+    If copy is False, the same list is yielded every time, permuted in
+    place, which saves copying it for each permutation; it must not be
+    modified by the caller.
+
     This is a classical algorithm; as used in C++ std::next_permutation().
     From http://blog.bjrn.se/2008/04/lexicographic-permutations-using.html
     """
     if not seq:
-        raise StopIteration
+        return
     try:
         seq[0]
     except TypeError:
         raise TypeError("seq must allow random access.")
 
-    first = 0
-    last = len(seq)
     seq = list(seq)
-
-    # Yield a copy of the sequence itself.
-    yield seq[:]
-    
-    if last == 1:
-        raise StopIteration
+    # The keys are computed once, and permuted alongside the items.
+    keys = seq if key is None else [key(x) for x in seq]
+    last = len(seq) - 1
+    yield seq[:] if copy else seq
 
     while True:
-        next = last - 1
+        # Step 1: find the longest non-increasing suffix.
+        i = last - 1
+        while i >= 0 and keys[i] >= keys[i+1]:
+            i -= 1
+        if i < 0:
+            return
+        # Step 2: swap its predecessor with the last greater item.
+        j = last
+        while keys[i] >= keys[j]:
+            j -= 1
+        seq[i], seq[j] = seq[j], seq[i]
+        if keys is not seq:
+            keys[i], keys[j] = keys[j], keys[i]
+            keys[i+1:] = keys[:i:-1]
+        # Step 3: reverse the suffix.
+        seq[i+1:] = seq[:i:-1]
+        yield seq[:] if copy else seq
 
-        while True:
-            # Step 1.
-            next1 = next
-            next -= 1
-            
-            if key(seq[next]) < key(seq[next1]):
-                # Step 2.
-                mid = last - 1
-                while key(seq[next]) >= key(seq[mid]):
-                    mid -= 1
-                seq[next], seq[mid] = seq[mid], seq[next]
-                
-                # Step 3.
-                reverse(seq, next1, last)
-
-                # Change to yield references to get rid of
-                # (at worst) |seq|! copy operations.
-                yield seq[:]
+def multiset_permutations(seq, start=0, key=None, copy=True):
+    """ Returns a generator that yields the unique permutations of seq in
+    lexicographical order, based on the ordering key given, starting from
+    the one of the given rank; see multiset_permutations_from.
+    """
+    return multiset_permutations_from(multiset_unrank(seq, start, key),
+                                      key, copy)
+
+def _multiset_counts(seq, key):
+    """ Returns the sorted distinct keys of seq, a representative item for
+    each, and a dictionary of their multiplicities.
+    """
+    counts = collections.Counter()
+    items = {}
+    for x in seq:
+        k = x if key is None else key(x)
+        counts[k] += 1
+        items.setdefault(k, x)
+    distinct = sorted(counts)
+    return distinct, [items[k] for k in distinct], counts
+
+def multiset_count(seq):
+    """ Returns the number of unique permutations of seq, i.e. the
+    multinomial coefficient len(seq)! / (m1! m2! ...) for the
+    multiplicities m1, m2, ... of its items.
+    """
+    total = 1
+    n = 0
+    for c in collections.Counter(seq).values():
+        for i in range(1, c+1):
+            n += 1
+            total = total * n // i
+    return total
+
+def multiset_rank(seq, key=None):
+    """ Returns the rank of seq among the unique permutations of its items,
+    in lexicographical order based on the ordering key given; items with
+    equal keys are taken to be equal. This takes O(n*d) time, for d
+    distinct keys.
+    """
+    keys = list(seq) if key is None else [key(x) for x in seq]
+    distinct, _, counts = _multiset_counts(keys, None)
+    n = len(keys)
+    total = multiset_count(keys)
+    rank = 0
+    for k in keys:
+        for k2 in distinct:
+            if k2 == k:
+                break
+            # The permutations with k2 here come first.
+            rank += total * counts[k2] // n
+        total = total * counts[k] // n
+        counts[k] -= 1
+        n -= 1
+    return rank
+
+def multiset_unrank(seq, rank, key=None):
+    """ Returns the unique permutation of the items of seq with the given
+    rank, in lexicographical order based on the ordering key given, as
+    a list; this is the inverse of multiset_rank.
+    """
+    groups = collections.defaultdict(list)
+    for x in seq:
+        groups[x if key is None else key(x)].append(x)
+    distinct = sorted(groups)
+    counts = dict((k, len(groups[k])) for k in distinct)
+    n = sum(counts.values())
+    total = multiset_count(seq if key is None else map(key, seq))
+    if not 0 <= rank < total:
+        raise IndexError("Rank {} is out of range".format(rank))
+    result = []
+    for _ in range(n):
+        for k in distinct:
+            size = total * counts[k] // n
+            if rank < size:
                 break
-            if next == first:
-                raise StopIteration
+            rank -= size
+        result.append(groups[k][len(groups[k]) - counts[k]])
+        total = size
+        counts[k] -= 1
+        n -= 1
+    return result
+
+TEMPLATE_LENGTH = 7 # Permutations of suffixes this long are precomputed.
+
+def multiset_permutation_array(seq, start=0, stop=None, key=None):
+    """ Returns a numpy array whose rows are the unique permutations of
+    seq with ranks in range(start, stop), in lexicographical order based on
+    the ordering key given; by default, all of them.
+
+    Items with equal keys are taken to be equal, and each is represented
+    by the first of them in seq. The array is filled block by block, using
+    precomputed tables of the permutations of short suffixes, so that
+    millions of permutations take well under a second.
+    """
+    distinct, items, counts = _multiset_counts(seq, key)
+    counts = tuple(counts[k] for k in distinct)
+    total = multiset_count(seq if key is None else map(key, seq))
+    stop = total if stop is None else min(stop, total)
+    start = max(start, 0)
+    dtype = np.uint8 if len(distinct) <= 256 else np.int64
+    out = np.empty((max(stop - start, 0), sum(counts)), dtype=dtype)
+    if len(out):
+        _fill_permutations(out, counts, total, start, stop, {})
+    return np.asarray(items)[out]
+
+def _fill_permutations(out, counts, total, lo, hi, templates):
+    """ Fills out with the permutations of ranks lo to hi of the multiset
+    with the given multiplicities, of which there are total.
+    """
+    n = sum(counts)
+    if n <= TEMPLATE_LENGTH:
+        out[:] = _permutation_template(counts, out.dtype, templates)[lo:hi]
+        return
+    offset = 0
+    for v, c in enumerate(counts):
+        if not c:
+            continue
+        size = total * c // n
+        a, b = max(lo, offset), min(hi, offset + size)
+        if a < b:
+            rows = out[a-lo:b-lo]
+            rows[:, 0] = v
+            rest = counts[:v] + (c-1,) + counts[v+1:]
+            _fill_permutations(rows[:, 1:], rest, size, a - offset,
+                               b - offset, templates)
+        offset += size
+        if offset >= hi:
+            break
+
+def _permutation_template(counts, dtype, templates):
+    """ Returns an array of all permutations of the multiset with the given
+    multiplicities, memoized in templates.
+    """
+    if counts in templates:
+        return templates[counts]
+    blocks = []
+    for v, c in enumerate(counts):
+        if c:
+            rest = counts[:v] + (c-1,) + counts[v+1:]
+            block = _permutation_template(rest, dtype, templates)
+            column = np.full((len(block), 1), v, dtype=dtype)
+            blocks.append(np.hstack((column, block)))
+    if not blocks:
+        blocks = [np.empty((1, 0), dtype=dtype)]
+    templates[counts] = np.concatenate(blocks)
+    return templates[counts]
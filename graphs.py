@@ -3,41 +3,168 @@ Requires networkx or a networkx-compatible graph class to work properly.
 """
 from __future__ import division, print_function
 import collections
+import heapq
+import lazy
+np = lazy.LazyModule('numpy')
+
+BipartiteCSR = collections.namedtuple('BipartiteCSR',
+                                      ['left', 'right', 'indptr', 'indices'])
+BipartiteCSR.__doc__ = """ A compact representation of a bipartite graph.
+
+left and right are lists of the nodes in each part. The neighbours of
+left[i] are the nodes right[j] for j in indices[indptr[i]:indptr[i+1]];
+indptr and indices are numpy integer arrays.
+"""
+
+def csr_from_graph(graph, p1):
+    """ Converts a bipartite graph (as a networkx.Graph) into a BipartiteCSR,
+    given the sequence of nodes corresponding to one part of the graph.
+    """
+    left = list(p1)
+    right_index = {}
+    indptr = [0]
+    indices = []
+    for n in left:
+        for n2 in graph.neighbors(n):
+            indices.append(right_index.setdefault(n2, len(right_index)))
+        indptr.append(len(indices))
+    return _make_csr(left, right_index, indptr, indices)
+
+def csr_from_edges(edges):
+    """ Converts a bipartite graph, given as a sequence of edges (n1, n2)
+    with each n1 in the first part and each n2 in the second, into
+    a BipartiteCSR.
+
+    As in a networkx graph, the two parts must not share any labels, since
+    the matching functions return a single dictionary of partners; e.g.
+    tag them as ('l', n1) and ('r', n2). A ValueError is raised if they
+    overlap. (To match on raw indices, use hopcroft_karp_arrays instead.)
+    """
+    left_index = {}
+    right_index = {}
+    lefts = []
+    rights = []
+    for n1, n2 in edges:
+        lefts.append(left_index.setdefault(n1, len(left_index)))
+        rights.append(right_index.setdefault(n2, len(right_index)))
+    if not set(left_index).isdisjoint(right_index):
+        raise ValueError("The two parts of the graph share labels.")
+    lefts = np.array(lefts, dtype=np.int64)
+    order = np.argsort(lefts, kind='stable')
+    indptr = np.zeros(len(left_index)+1, dtype=np.int64)
+    np.cumsum(np.bincount(lefts, minlength=len(left_index)), out=indptr[1:])
+    indices = np.array(rights, dtype=np.int64)[order]
+    return _make_csr(list(left_index), right_index, indptr, indices)
+
+def _make_csr(left, right_index, indptr, indices):
+    """ Builds a BipartiteCSR from lists of nodes and indices. """
+    right = [None] * len(right_index)
+    for n, i in right_index.items():
+        right[i] = n
+    return BipartiteCSR(left, right, np.asarray(indptr, dtype=np.int64),
+                        np.asarray(indices, dtype=np.int64))
 
 def maximum_matching(graph, p1):
     """ Finds a maximum matching within a bipartite graph; the required
     inputs are the graph (as a networkx.Graph) and the sequence of
     nodes corresponding to one part of the bipartite graph.
     
-    The approach used is to construct a maximal matching, and then augment
-    it by finding augmenting paths with a breadth-first search.
+    The graph is converted into a BipartiteCSR, and then matched with the
+    Hopcroft-Karp algorithm; see hopcroft_karp.
     
     Matches are stored as a dictionary that stores the matching partner for
     each node; this is what is returned. Consequently, the number of edges
     in the matching is precisely len(matches) // 2.
     """
-    # First construct a maximal matching.
+    return hopcroft_karp(csr_from_graph(graph, p1))
+
+def hopcroft_karp(csr):
+    """ Finds a maximum matching within a bipartite graph, given as
+    a BipartiteCSR, in O(E sqrt(V)) time.
+
+    The result is a dictionary storing the matching partner for each
+    matched node, as for maximum_matching.
+    """
+    match_left, match_right = hopcroft_karp_arrays(csr.indptr, csr.indices,
+                                                   len(csr.right))
+    left, right = csr.left, csr.right
     matches = {}
-    for n in p1: # Match every node that we can.
-        for n2 in graph.neighbors(n):
-            if n2 not in matches:
-                matches[n] = n2
-                matches[n2] = n
-                break
-    # Now upgrade it via augmenting paths.
-    bads = set()
-    for n in p1:
-        if n in bads or n in matches:
-            continue
-        path, visited = find_augmenting_path(graph, n, matches, bads)
-        if path is None: # No path found - all visited nodes must be dead ends.
-            bads.update(visited) 
-            continue
-        for n1, n2 in path: # The path was found
-            matches[n1] = n2
-            matches[n2] = n1
+    for i, j in enumerate(match_left):
+        if j >= 0:
+            matches[left[i]] = right[j]
+            matches[right[j]] = left[i]
     return matches
 
+def hopcroft_karp_arrays(indptr, indices, num_right):
+    """ The Hopcroft-Karp algorithm on raw CSR arrays (see BipartiteCSR).
+
+    Returns two lists, giving the index of the partner of each left and
+    each right node respectively, or -1 for unmatched nodes.
+
+    Each phase finds the shortest augmenting paths with a breadth-first
+    search, and then augments along a maximal set of disjoint shortest
+    paths with an iterative depth-first search.
+    """
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    num_left = len(indptr) - 1
+    # Python lists of neighbours are much faster to iterate over.
+    adj = [indices[indptr[i]:indptr[i+1]] for i in range(num_left)]
+    match_left = [-1] * num_left
+    match_right = [-1] * num_right
+    # Start from a greedy maximal matching.
+    for i, neighbors in enumerate(adj):
+        for j in neighbors:
+            if match_right[j] < 0:
+                match_left[i] = j
+                match_right[j] = i
+                break
+    while True:
+        # Build the layers of the alternating-path search.
+        free = [i for i in range(num_left) if match_left[i] < 0]
+        dist = [-1] * num_left
+        for i in free:
+            dist[i] = 0
+        queue = list(free)
+        found = num_left # The layer in which a free right node was found.
+        for i in queue:
+            d = dist[i]
+            if d > found: # Only the shortest paths are needed.
+                break
+            for j in adj[i]:
+                i2 = match_right[j]
+                if i2 < 0:
+                    found = d
+                elif dist[i2] < 0:
+                    dist[i2] = d + 1
+                    queue.append(i2)
+        if found == num_left:
+            return match_left, match_right
+        # Augment along disjoint shortest paths.
+        pos = [0] * num_left
+        for root in free:
+            stack = [root]
+            while stack:
+                i = stack[-1]
+                k = pos[i]
+                if k == len(adj[i]): # A dead end; never visit it again.
+                    dist[i] = -1
+                    stack.pop()
+                    if stack:
+                        pos[stack[-1]] += 1
+                    continue
+                i2 = match_right[adj[i][k]]
+                if i2 < 0: # Found a path - flip the matching along it.
+                    for i in stack:
+                        j = adj[i][pos[i]]
+                        match_left[i] = j
+                        match_right[j] = i
+                    break
+                if dist[i2] == dist[i] + 1:
+                    stack.append(i2)
+                else:
+                    pos[i] += 1
+
 def find_augmenting_path(graph, node, matches, bads):
     """ Finds augmenting paths for a matching of a bipartite graph.
 
@@ -83,3 +210,402 @@ def find_augmenting_path(graph, node, matches, bads):
                 next_level.append(n3)
         current_level = next_level
     return None, visited
+
+def csr_weights(graph, csr, weight='weight'):
+    """ Returns the weights of the edges of a BipartiteCSR built from the
+    given graph, as a float array aligned with csr.indices.
+    """
+    weights = np.empty(len(csr.indices))
+    for i, n in enumerate(csr.left):
+        for k in range(csr.indptr[i], csr.indptr[i+1]):
+            weights[k] = graph[n][csr.right[csr.indices[k]]][weight]
+    return weights
+
+def hungarian(cost):
+    """ Solves the assignment problem for the given cost matrix, i.e. finds
+    the assignment of rows to distinct columns (or columns to distinct rows,
+    if there are fewer columns) with the minimum total cost.
+
+    Forbidden pairs may be given a cost of inf; a ValueError is raised if
+    no complete assignment is possible. Returns two arrays, of the row and
+    column indices of the assigned pairs, in order of rows.
+
+    This is the O(n^3) Hungarian algorithm, in the form that grows one
+    shortest augmenting path per row, with the work over columns vectorized.
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = hungarian(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+    n, m = cost.shape
+    # Rows and columns are numbered from 1; column 0 is a dummy.
+    u = np.zeros(n+1) # Row potentials.
+    v = np.zeros(m+1) # Column potentials.
+    match = np.zeros(m+1, dtype=np.int64) # The row matched to each column.
+    way = np.zeros(m+1, dtype=np.int64) # The previous column on the path.
+    for i in range(1, n+1):
+        match[0] = i
+        j0 = 0
+        min_slack = np.full(m+1, np.inf)
+        used = np.zeros(m+1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = match[j0]
+            free = ~used
+            free[0] = False
+            slack = cost[i0-1] - u[i0] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = j0
+            candidates = np.where(free, min_slack, np.inf)
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+            if delta == np.inf:
+                raise ValueError("No complete assignment is possible.")
+            u[match[used]] += delta
+            v[used] -= delta
+            min_slack[free] -= delta
+            j0 = j1
+            if match[j0] == 0:
+                break
+        while j0: # Flip the matching along the augmenting path.
+            j1 = way[j0]
+            match[j0] = match[j1]
+            j0 = j1
+    cols = np.flatnonzero(match[1:])
+    rows = match[cols+1] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+def min_weight_matching(graph, p1, weight='weight'):
+    """ Finds a minimum-weight matching within a bipartite graph (as
+    a networkx.Graph) that matches every node of the smaller part, given
+    the sequence of nodes corresponding to one part of the graph; a
+    ValueError is raised if there is no such matching.
+
+    Uses hungarian on the dense cost matrix; see sparse_min_weight_matching
+    for large sparse graphs. The result is a dictionary storing the
+    matching partner for each matched node, as for maximum_matching.
+    """
+    csr = csr_from_graph(graph, p1)
+    cost = np.full((len(csr.left), len(csr.right)), np.inf)
+    rows = np.repeat(np.arange(len(csr.left)), np.diff(csr.indptr))
+    cost[rows, csr.indices] = csr_weights(graph, csr, weight)
+    matches = {}
+    for i, j in zip(*hungarian(cost)):
+        matches[csr.left[i]] = csr.right[j]
+        matches[csr.right[j]] = csr.left[i]
+    return matches
+
+def sparse_min_weight_matching(csr, weights, tolerance=1e-9):
+    """ Finds a maximum matching within a bipartite graph, given as
+    a BipartiteCSR with the edge weights aligned with csr.indices, that has
+    the minimum total weight among all maximum matchings.
+
+    Integer weights give an exact result; other weights are first rounded
+    to multiples of the given tolerance.
+
+    A maximum matching from hopcroft_karp_arrays splits the graph, by the
+    Dulmage-Mendelsohn decomposition, into three parts: one that every
+    maximum matching matches perfectly, and two in which one side is always
+    fully matched. Each part is then an assignment problem, which is solved
+    by the epsilon-scaling auction algorithm (see _auction), so the running
+    time grows only with the logarithm of the range of the weights. Only
+    O(E) memory is used.
+
+    The result is a dictionary storing the matching partner for each
+    matched node, as for maximum_matching.
+    """
+    num_left, num_right = len(csr.left), len(csr.right)
+    weights = np.asarray(weights, dtype=float)
+    if not np.array_equal(weights, np.round(weights)):
+        weights = weights / tolerance
+    weights = [int(w) for w in np.round(weights).tolist()]
+    indptr = csr.indptr.tolist()
+    indices = csr.indices.tolist()
+    match_left, match_right = hopcroft_karp_arrays(csr.indptr, csr.indices,
+                                                   num_right)
+    # The cheapest edge between each pair of neighbours, from either end.
+    adj_left = [{} for _ in range(num_left)]
+    adj_right = [{} for _ in range(num_right)]
+    for i in range(num_left):
+        for k in range(indptr[i], indptr[i+1]):
+            j = indices[k]
+            if weights[k] < adj_left[i].get(j, weights[k] + 1):
+                adj_left[i][j] = adj_right[j][i] = weights[k]
+    # Group 1 is everything reachable by alternating paths from the free
+    # left nodes, and group 2 likewise from the free right nodes; every
+    # maximum matching pairs the nodes of each group (or of neither) with
+    # each other, and covers the right nodes of group 1 and the left nodes
+    # of group 2.
+    group_left = [0] * num_left
+    group_right = [0] * num_right
+    for g, adj, group, other_group, match, other_match in (
+            (1, adj_left, group_left, group_right, match_left, match_right),
+            (2, adj_right, group_right, group_left, match_right, match_left)):
+        queue = [n for n in range(len(adj)) if match[n] < 0]
+        for n in queue:
+            group[n] = g
+        for n in queue:
+            for n2 in adj[n]:
+                if not other_group[n2]:
+                    other_group[n2] = g
+                    group[other_match[n2]] = g
+                    queue.append(other_match[n2])
+    matches = {}
+    for g, adj, group, other_group, nodes, other_nodes in (
+            (0, adj_left, group_left, group_right, csr.left, csr.right),
+            (1, adj_right, group_right, group_left, csr.right, csr.left),
+            (2, adj_left, group_left, group_right, csr.left, csr.right)):
+        # The persons are the nodes on the side that is fully matched.
+        persons = [n for n in range(len(group)) if group[n] == g]
+        objects = [n for n in range(len(other_group)) if other_group[n] == g]
+        index = dict((n, k) for k, n in enumerate(objects))
+        choices = [[(index[n2], w) for n2, w in adj[n].items()
+                    if other_group[n2] == g] for n in persons]
+        for n, k in zip(persons, _auction(choices, len(objects))):
+            matches[nodes[n]] = other_nodes[objects[k]]
+            matches[other_nodes[objects[k]]] = nodes[n]
+    return matches
+
+def _auction(choices, num_objects):
+    """ Solves an assignment problem with the epsilon-scaling auction
+    algorithm, given for each person a list of the (object, cost) pairs it
+    may be assigned, with integer costs. There may be fewer persons than
+    objects. Returns the object assigned to each person.
+
+    Costs are scaled so that an assignment within 1 of optimal is optimal,
+    and each phase divides epsilon by 8. Surplus objects are taken by dummy
+    persons that may have any object at no cost; these always bid for the
+    cheapest object, found through a heap of the prices.
+    """
+    num_persons = len(choices)
+    num_dummies = num_objects - num_persons
+    scale = num_objects + 1
+    objects = [[j for j, c in edges] for edges in choices]
+    costs = [[c * scale for j, c in edges] for edges in choices]
+    all_costs = [0] + [c for edges in costs for c in edges]
+    # A bid for an object that is a person's only choice needs some bound.
+    spread = max(all_costs) - min(all_costs) + scale
+    price = [0] * num_objects
+    owner = [-1] * num_objects
+    assigned = [-1] * (num_persons + num_dummies)
+    heap = [(0, j) for j in range(num_objects)]
+    eps = spread
+    while eps > 1:
+        eps = max(eps // 8, 1)
+        # Keep the assignments that are still within eps of the best.
+        unassigned = []
+        for i in range(num_persons + num_dummies):
+            j = assigned[i]
+            if j >= 0:
+                if i < num_persons:
+                    c = costs[i][objects[i].index(j)]
+                    best = min([c2 + price[j2] for j2, c2
+                                in zip(objects[i], costs[i])])
+                    if c + price[j] <= best + eps:
+                        continue
+                owner[j] = assigned[i] = -1
+            unassigned.append(i)
+        while unassigned:
+            i = unassigned.pop()
+            if i < num_persons:
+                best = second = None
+                for j, c in zip(objects[i], costs[i]):
+                    v = c + price[j]
+                    if best is None or v < best:
+                        second = best
+                        best = v
+                        best_j = j
+                    elif second is None or v < second:
+                        second = v
+            else:
+                while heap[0][0] != price[heap[0][1]]:
+                    heapq.heappop(heap)
+                best, best_j = heapq.heappop(heap)
+                while heap and heap[0][0] != price[heap[0][1]]:
+                    heapq.heappop(heap)
+                second = heap[0][0] if heap else None
+            if second is None:
+                second = best + spread
+            price[best_j] += second - best + eps
+            heapq.heappush(heap, (price[best_j], best_j))
+            if len(heap) > 4 * num_objects: # Drop the outdated prices.
+                heap = [(price[j], j) for j in range(num_objects)]
+                heapq.heapify(heap)
+            i2 = owner[best_j]
+            owner[best_j] = i
+            assigned[i] = best_j
+            if i2 >= 0:
+                assigned[i2] = -1
+                unassigned.append(i2)
+    return assigned[:num_persons]
+
+MaxFlow = collections.namedtuple('MaxFlow', ['value', 'flows', 'cut'])
+MaxFlow.__doc__ = """ The result of dinic: the value of the maximum flow, the
+flow along each edge (a list aligned with the input edges), and a boolean
+numpy array marking the nodes on the source side of a minimum cut.
+"""
+
+def dinic(num_nodes, tails, heads, capacities, source, sink):
+    """ Finds a maximum flow from source to sink with Dinic's algorithm, in
+    a network whose nodes are 0, ..., num_nodes-1 and whose directed edges
+    are tails[k] -> heads[k] with capacity capacities[k]; capacities may be
+    ints, floats or inf. Returns a MaxFlow; a ValueError is raised if the
+    flow is unbounded.
+
+    The residual graph is kept in flat arrays, edge 2k being the forward
+    edge k and edge 2k+1 its reverse, with a CSR index by tail node. Each
+    phase builds the level graph by BFS, and then finds a blocking flow by
+    an iterative DFS that never revisits dead ends.
+    """
+    num_edges = len(tails)
+    starts = np.empty(2*num_edges, dtype=np.int64)
+    starts[0::2] = tails
+    starts[1::2] = heads
+    ends = np.empty(2*num_edges, dtype=np.int64)
+    ends[0::2] = heads
+    ends[1::2] = tails
+    indptr = np.zeros(num_nodes+1, dtype=np.int64)
+    np.cumsum(np.bincount(starts, minlength=num_nodes), out=indptr[1:])
+    adjacent = np.argsort(starts, kind='stable').tolist()
+    indptr = indptr.tolist()
+    ends = ends.tolist()
+    residual = [0] * (2*num_edges)
+    residual[0::2] = [c.item() if hasattr(c, 'item') else c
+                      for c in capacities]
+    value = 0
+    while True:
+        # Build the level graph.
+        level = [-1] * num_nodes
+        level[source] = 0
+        queue = collections.deque([source])
+        while queue and level[sink] < 0:
+            n = queue.popleft()
+            for e in adjacent[indptr[n]:indptr[n+1]]:
+                n2 = ends[e]
+                if level[n2] < 0 and residual[e] > 0:
+                    level[n2] = level[n] + 1
+                    queue.append(n2)
+        if level[sink] < 0:
+            break
+        # Find a blocking flow.
+        pos = indptr[:-1]
+        path = [] # The edges from the source to n.
+        n = source
+        while True:
+            if n == sink:
+                flow = min(residual[e] for e in path)
+                if flow == float('inf'):
+                    raise ValueError("Infinite capacity path; unbounded flow.")
+                for e in path:
+                    residual[e] -= flow
+                    residual[e^1] += flow
+                value += flow
+                # Retreat to the tail of the first saturated edge.
+                for k, e in enumerate(path):
+                    if not residual[e] > 0:
+                        break
+                del path[k:]
+                n = ends[path[-1]] if path else source
+                continue
+            k = pos[n]
+            end = indptr[n+1]
+            while k < end:
+                e = adjacent[k]
+                n2 = ends[e]
+                if residual[e] > 0 and level[n2] == level[n] + 1:
+                    break
+                k += 1
+            pos[n] = k
+            if k < end:
+                path.append(e)
+                n = n2
+            elif n == source:
+                break
+            else: # A dead end; retreat.
+                level[n] = -1
+                n = ends[path.pop()^1]
+                pos[n] += 1
+    # The nodes reached by the last BFS form the source side of a min cut.
+    return MaxFlow(value, residual[1::2], np.array(level) >= 0)
+
+def _flow_arrays(graph, capacity):
+    """ Lists the nodes of a networkx-compatible graph and its edges as
+    arrays for dinic, with both directions of each undirected edge. Edges
+    without the capacity attribute have infinite capacity.
+    """
+    nodes = list(graph)
+    index = dict((n, i) for i, n in enumerate(nodes))
+    tails = []
+    heads = []
+    capacities = []
+    for n1, n2, data in graph.edges(data=True):
+        c = data.get(capacity, float('inf'))
+        tails.append(index[n1])
+        heads.append(index[n2])
+        capacities.append(c)
+        if not graph.is_directed():
+            tails.append(index[n2])
+            heads.append(index[n1])
+            capacities.append(c)
+    return nodes, index, tails, heads, capacities
+
+def max_flow(graph, source, sink, capacity='capacity'):
+    """ Finds a maximum flow from source to sink within a graph (as a
+    networkx.Graph or DiGraph) whose edges have the given capacity
+    attribute; edges without it have infinite capacity.
+
+    Returns the value of the flow, and a dictionary storing for each node
+    u a dictionary of the flow along each edge (u, v); for undirected
+    graphs, opposite flows along an edge are cancelled out.
+    """
+    nodes, index, tails, heads, capacities = _flow_arrays(graph, capacity)
+    result = dinic(len(nodes), tails, heads, capacities,
+                   index[source], index[sink])
+    flows = dict((n, {}) for n in nodes)
+    for t, h, f in zip(tails, heads, result.flows):
+        flows[nodes[t]][nodes[h]] = f
+    if not graph.is_directed():
+        for n1, n2 in graph.edges():
+            f = flows[n1][n2] - flows[n2][n1]
+            flows[n1][n2] = max(f, 0)
+            flows[n2][n1] = max(-f, 0)
+    return result.value, flows
+
+def min_cut(graph, source, sink, capacity='capacity'):
+    """ Finds a minimum cut separating source from sink within a graph,
+    with capacities as for max_flow. Returns the value of the cut and the
+    partition (reachable, non_reachable) of the nodes into two sets, the
+    first containing the source.
+    """
+    nodes, index, tails, heads, capacities = _flow_arrays(graph, capacity)
+    result = dinic(len(nodes), tails, heads, capacities,
+                   index[source], index[sink])
+    reachable = set(n for n, c in zip(nodes, result.cut) if c)
+    return result.value, (reachable, set(nodes) - reachable)
+
+def flow_matching(graph, p1):
+    """ Finds a maximum matching within a bipartite graph, with the same
+    inputs and result as maximum_matching, as a unit-capacity flow problem
+    solved by dinic; this also runs in O(E sqrt(V)) time.
+    """
+    csr = csr_from_graph(graph, p1)
+    num_left, num_right = len(csr.left), len(csr.right)
+    source = num_left + num_right
+    sink = source + 1
+    left_nodes = np.arange(num_left)
+    right_nodes = np.arange(num_left, source)
+    rows = np.repeat(left_nodes, np.diff(csr.indptr))
+    tails = np.concatenate((np.full(num_left, source), rows, right_nodes))
+    heads = np.concatenate((left_nodes, csr.indices + num_left,
+                            np.full(num_right, sink)))
+    result = dinic(sink+1, tails, heads, [1] * len(tails), source, sink)
+    matches = {}
+    for k in np.flatnonzero(result.flows[num_left:num_left+len(rows)]):
+        n1 = csr.left[rows[k]]
+        n2 = csr.right[csr.indices[k]]
+        matches[n1] = n2
+        matches[n2] = n1
+    return matches
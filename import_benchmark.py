@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+""" Measures the startup cost of the library: the time taken to import each
+module in a fresh interpreter, and to run a trivial solution built from
+template.py, against a budget for the latter.
+
+Usage: python import_benchmark.py [-r REPEATS] [-b BUDGET_MS] [MODULE ...]
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULES = ['codejam_io', 'memo', 'combinatorics', 'graphs', 'primes',
+           'multiplicative']
+BUDGET_MS = 100 # The target startup time for a trivial solution.
+
+def run_time(args, repeats, cwd=None):
+    """ Returns the best wall time, in ms, of running the given command. """
+    env = dict(os.environ)
+    paths = [LIB_DIR, env.get('PYTHONPATH')]
+    env['PYTHONPATH'] = os.pathsep.join(p for p in paths if p)
+    best = float('inf')
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeats):
+            start = time.time()
+            subprocess.check_call(args, cwd=cwd, env=env, stdout=devnull)
+            best = min(best, time.time() - start)
+    return 1000 * best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    parser.add_argument('-b', '--budget', type=float, default=BUDGET_MS,
+                        help="startup budget for a trivial solution, in ms")
+    args = parser.parse_args(argv)
+
+    python = sys.executable
+    base = run_time([python, '-c', 'pass'], args.repeats)
+    print("{:<16} {:>9} {:>9}".format("module", "total ms", "import ms"))
+    print("{:<16} {:>9.1f} {:>9}".format("(interpreter)", base, "-"))
+    for name in args.modules:
+        total = run_time([python, '-c', 'import ' + name], args.repeats)
+        print("{:<16} {:>9.1f} {:>9.1f}".format(name, total, total - base))
+
+    # Run a trivial solution, as a contestant would.
+    work = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(LIB_DIR, 'template.py'), work)
+        with open(os.path.join(work, 'test.in'), 'w') as f:
+            f.write("1\n\n")
+        total = run_time([python, 'template.py', '-n'], args.repeats, work)
+    finally:
+        shutil.rmtree(work)
+    verdict = "OK" if total <= args.budget else "OVER BUDGET"
+    print("{:<16} {:>9.1f} {:>9.1f}  {} (budget {:.0f} ms)".format(
+        "template.py", total, total - base, verdict, args.budget))
+    return 0 if total <= args.budget else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
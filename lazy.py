@@ -0,0 +1,50 @@
+""" Lazy loading of heavy modules, so that importing the library (and
+hence starting up a solution) stays fast; e.g.
+
+    np = lazy.LazyModule('numpy')
+
+binds np to a stand-in that imports numpy the first time one of its
+attributes is used.
+"""
+import importlib
+
+class LazyModule(object):
+    """ A stand-in for a module that is only imported on first use.
+
+    Each attribute is looked up on the real module once, and then cached on
+    the stand-in itself, so later lookups cost no more than usual.
+
+    The stand-in is true if the module can be imported, and false if not,
+    which suits optional dependencies:
+
+        gmpy2 = LazyModule('gmpy2')
+        ...
+        if gmpy2:
+            ...
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        """ Imports and returns the real module. """
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __bool__(self):
+        try:
+            self._load()
+        except ImportError:
+            return False
+        return True
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        state = 'unloaded' if self._module is None else 'loaded'
+        return "<lazy module '{}' ({})>".format(self._name, state)
@@ -3,29 +3,274 @@ for dynamic programming problems.
 """
 import collections
 import functools
+import sys
+import weakref
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+_KWARGS_MARK = object() # Separates positional and keyword arguments in keys.
+_instances = weakref.WeakSet() # Every memoized function, for clear_caches.
 
 class memoized(object):
    """Decorator. Caches a function's return value each time it is called.
    If called later with the same arguments, the cached value is returned
    (not reevaluated).
+
+   Can be used either as @memoized, or with options as, e.g.
+   @memoized(maxsize=10**6, policy='clear'). If maxsize is given, the
+   cache is bounded, and once it is full the policy decides what happens:
+      'lru'    The least recently used value is evicted.
+      'clear'  The whole cache is cleared; this is much cheaper, and suits
+               searches that rarely revisit old states.
+
+   cache_info() gives the hit/miss statistics, and cache_clear() resets the
+   cache; clear_caches() resets every memoized function, e.g. between cases.
    """
-   def __init__(self, func):
+   def __new__(cls, func=None, **options):
+      if func is None:
+         return functools.partial(cls, **options)
+      return object.__new__(cls)
+   def __init__(self, func, maxsize=None, policy='lru'):
+      if policy not in ('lru', 'clear'):
+         raise ValueError("Unknown eviction policy: {}".format(policy))
       self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      if not isinstance(args, collections.Hashable):
+      self.maxsize = maxsize
+      self._lru = maxsize is not None and policy == 'lru'
+      self.cache = collections.OrderedDict() if self._lru else {}
+      self.hits = 0
+      self.misses = 0
+      functools.update_wrapper(self, func)
+      _instances.add(self)
+   def __call__(self, *args, **kwargs):
+      key = args
+      if kwargs:
+         key += (_KWARGS_MARK,) + tuple(sorted(kwargs.items()))
+      cache = self.cache
+      try:
+         value = cache[key]
+      except KeyError:
+         pass
+      except TypeError:
          # uncacheable. a list, for instance.
          # better to not cache than blow up.
-         return self.func(*args)
-      if args in self.cache:
-         return self.cache[args]
+         return self.func(*args, **kwargs)
       else:
-         value = self.func(*args)
-         self.cache[args] = value
+         self.hits += 1
+         if self._lru: # Reinsert to mark as most recent; works on Python 2.
+            del cache[key]
+            cache[key] = value
          return value
+      self.misses += 1
+      value = self.func(*args, **kwargs)
+      if self.maxsize is not None and len(cache) >= self.maxsize:
+         if not cache:
+            return value
+         elif self._lru:
+            cache.popitem(last=False)
+         else:
+            cache.clear()
+      cache[key] = value
+      return value
+   def cache_info(self):
+      '''Return the hit/miss statistics and the size of the cache.'''
+      return CacheInfo(self.hits, self.misses, self.maxsize, len(self.cache))
+   def cache_clear(self):
+      '''Clear the cache and its statistics.'''
+      self.cache.clear()
+      self.hits = 0
+      self.misses = 0
    def __repr__(self):
       '''Return the function's docstring.'''
       return self.func.__doc__
    def __get__(self, obj, objtype):
       '''Support instance methods.'''
       return functools.partial(self.__call__, obj)
+
+def clear_caches():
+   """Clears the caches of every memoized function, e.g. between cases."""
+   for f in list(_instances):
+      f.cache_clear()
+
+_EMPTY = object() # Marks states that have not been evaluated yet.
+
+class _MissingState(BaseException):
+   """Raised within a stackless function when it needs a state that has
+   not been evaluated yet. This is a BaseException so that it passes
+   through any "except Exception" clauses in the function itself.
+   """
+   def __init__(self, owner, state):
+      BaseException.__init__(self, state)
+      self.owner = owner
+      self.state = state
+
+class _Evaluation(object):
+   """The state of an evaluation of missing states. It is shared by every
+   stackless function, so that mutually recursive ones use one explicit
+   stack.
+   """
+   def __init__(self):
+      self.running = False
+      self.depth = 0 # The current levels of recursion for missing states.
+      self.max_depth = 0
+      self.deepened = False
+
+_evaluation = _Evaluation()
+
+class stackless(object):
+   """Decorator. Memoizes a recursive function, but evaluates deep chains
+   of states on an explicit stack, so that they cannot hit the recursion
+   limit.
+
+   Missing states are evaluated by ordinary recursion, min_depth levels
+   deep, or once that is reached as deep as an eighth of the remaining
+   recursion limit (and at most max_depth levels). Beyond that, the call
+   that asks for a missing state is abandoned, the missing state is pushed
+   onto an explicit stack and evaluated first, and then the call is
+   retried. Hence the function must be deterministic, and it is
+   best if each state depends on few unevaluated states; the states
+   themselves should be arguments only. Evaluations within the recursion
+   limit run faster than with memoized, while in deeper chains each state
+   is called about twice, but the depth is unlimited. Stackless functions
+   that call one another share the explicit stack, so this holds for
+   mutual recursion too.
+
+   Can be used either as @stackless, storing states in a dict, or as e.g.
+   @stackless(shape=(n, m)) for states that are tuples of integers within
+   those bounds; these are stored in a dense flat list, which is far
+   smaller than a dict for large tables.
+   """
+   min_depth = 100 # Missing states are always evaluated by recursion here.
+   max_depth = 2000 # The most levels of recursion for missing states.
+   def __new__(cls, func=None, **options):
+      if func is None:
+         return functools.partial(cls, **options)
+      return object.__new__(cls)
+   def __init__(self, func, shape=None):
+      self.func = func
+      self.shape = None if shape is None else tuple(shape)
+      # The stride of each dimension of the flat table, for shape.
+      self._strides = None
+      if shape is not None:
+         self._strides = [1] * len(self.shape)
+         for k in range(len(self.shape) - 1, 0, -1):
+            self._strides[k-1] = self._strides[k] * self.shape[k]
+      self.cache_clear()
+      functools.update_wrapper(self, func)
+      _instances.add(self)
+   def __call__(self, *args):
+      shape = self.shape
+      if shape is None:
+         index = args
+         try:
+            value = self.table[args]
+         except KeyError:
+            value = _EMPTY
+      else:
+         # The flat index, inline; it is in bounds if every coordinate but
+         # the first is, and the index itself is.
+         if len(args) == 2:
+            i, j = args
+            n = shape[1]
+            index = i*n + j
+            if not 0 <= j < n:
+               index = -1
+         elif len(args) == 1:
+            index = args[0]
+         else:
+            index = 0
+            for i, n, stride in zip(args, shape, self._strides):
+               if not 0 <= i < n:
+                  index = -1
+                  break
+               index += i*stride
+         if not 0 <= index < len(self.table) or len(args) != len(shape):
+            raise IndexError("State {} is out of bounds".format(args))
+         value = self.table[index]
+      if value is not _EMPTY:
+         return value
+      evaluation = _evaluation
+      if not evaluation.running:
+         return self._evaluate(args, index)
+      if evaluation.depth >= evaluation.max_depth and not self._deepen():
+         raise _MissingState(self, args)
+      # Shallow enough to simply recurse, which avoids abandoning the call.
+      evaluation.depth += 1
+      try:
+         value = self.func(*args)
+      finally:
+         evaluation.depth -= 1
+      self.table[index] = value
+      return value
+   def _index(self, state):
+      '''Return the key of the given state in the table.'''
+      if self.shape is None:
+         return state
+      if len(state) == len(self.shape):
+         index = 0
+         for i, n, stride in zip(state, self.shape, self._strides):
+            if not 0 <= i < n:
+               break
+            index += i*stride
+         else:
+            return index
+      raise IndexError("State {} is out of bounds".format(state))
+   def _deepen(self):
+      '''Raise the recursion depth for missing states as far as the
+      recursion limit safely allows, once per evaluation; return whether it
+      was raised.'''
+      evaluation = _evaluation
+      if evaluation.deepened or evaluation.max_depth >= self.max_depth:
+         return False
+      evaluation.deepened = True
+      # Each level counts about three times against the recursion limit (the
+      # function, this method and the call between them), and the function
+      # may nest further calls of its own.
+      depth = 0
+      frame = sys._getframe()
+      while frame is not None:
+         depth += 1
+         frame = frame.f_back
+      levels = (sys.getrecursionlimit() - depth) // 8
+      evaluation.max_depth = min(self.max_depth, evaluation.depth + levels)
+      return evaluation.max_depth > evaluation.depth
+   def _evaluate(self, state, index):
+      '''Evaluate the given state, and any states it depends on, of this
+      or any other stackless function, with an explicit stack.'''
+      evaluation = _evaluation
+      stack = [(self, state, index)]
+      pending = set([(self, index)])
+      evaluation.max_depth = self.min_depth
+      evaluation.deepened = False
+      evaluation.running = True
+      try:
+         while stack:
+            owner, state, index = stack[-1]
+            try:
+               value = owner.func(*state)
+            except _MissingState as e:
+               dependency = (e.owner, e.owner._index(e.state))
+               if dependency in pending:
+                  raise RuntimeError(
+                     "Cyclic dependency on state {}".format(e.state))
+               stack.append((e.owner, e.state, dependency[1]))
+               pending.add(dependency)
+               continue
+            owner.table[index] = value
+            pending.remove((owner, index))
+            stack.pop()
+      finally:
+         evaluation.running = False
+      return value
+   def cache_clear(self):
+      '''Clear the table of evaluated states.'''
+      if self.shape is None:
+         self.table = {}
+      else:
+         size = 1
+         for n in self.shape:
+            size *= n
+         self.table = [_EMPTY] * size
+   def __repr__(self):
+      '''Return the function's docstring.'''
+      return self.func.__doc__
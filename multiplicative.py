@@ -0,0 +1,114 @@
+""" Sieves for multiplicative functions - Euler's totient function,
+the Mobius function, and the divisor functions - over ranges of numbers.
+
+The sieves make a single pass over the primes up to the square root of the
+end of the range, striking their multiples with numpy slices; whatever is
+left of each number after that is a single large prime factor.
+"""
+from __future__ import division, print_function
+import lazy
+np = lazy.LazyModule('numpy')
+import primes
+
+SEGMENT_SIZE = 2**20 # The default segment size for the streaming sieves.
+
+def phi_pp(p, e):
+    """ Euler's totient function, for a prime power p**e. """
+    return p**e - p**(e-1)
+
+def mobius_pp(p, e):
+    """ The Mobius function, for a prime power p**e. """
+    return -1 if e == 1 else 0
+
+def divisor_count_pp(p, e):
+    """ The number of divisors of a prime power p**e. """
+    return e + 1
+
+def divisor_sum_pp(p, e, k=1):
+    """ The sum of the k-th powers of the divisors of a prime power p**e. """
+    return sum(p**(i*k) for i in range(e+1))
+
+def sieve(fpp, start, stop, base=None):
+    """ Returns the values of a multiplicative function f for the numbers
+    from start to stop, as an int64 array, where fpp(p, e) gives f(p**e).
+
+    Note that start is inclusive, and stop is exclusive; f(0) is taken to be
+    0. fpp is also called with e=1 and a numpy array of primes p, so it must
+    work for arrays. base, if given, must contain every prime whose square
+    is below stop; by default these are taken from primes.p32.
+    """
+    start = max(start, 0)
+    if stop <= start:
+        return np.zeros(0, dtype=np.int64)
+    if base is None:
+        base = primes.p32.between(0, primes.isqrt(stop-1)+1)
+    values = np.empty(stop-start, dtype=np.int64)
+    # Working a segment at a time is much more cache-friendly.
+    for lo in range(start, stop, SEGMENT_SIZE):
+        hi = min(lo+SEGMENT_SIZE, stop)
+        values[lo-start:hi-start] = _sieve_segment(fpp, lo, hi, base)
+    return values
+
+def iter_sieve(fpp, start, stop, size=SEGMENT_SIZE):
+    """ Generates the values of a multiplicative function over the numbers
+    from start to stop (see sieve), as a sequence of arrays for consecutive
+    segments of the given size, so that the memory used does not depend on
+    the length of the range.
+    """
+    base = primes.p32.between(0, primes.isqrt(max(stop-1, 0))+1)
+    for lo in range(max(start, 0), stop, size):
+        yield _sieve_segment(fpp, lo, min(lo+size, stop), base)
+
+def _sieve_segment(fpp, start, stop, base):
+    """ Inner method for sieve, which sieves the whole range at once. """
+    values = np.ones(stop-start, dtype=np.int64)
+    # The product of the prime powers dividing each number, for the primes
+    # sieved so far; whatever remains after that is one large prime.
+    parts = np.ones(stop-start, dtype=np.int64)
+    for p in base.tolist():
+        if p*p >= stop:
+            break
+        offset = -start % p
+        if offset >= len(values):
+            continue
+        parts[offset::p] *= p
+        exponents = np.ones(len(parts[offset::p]), dtype=np.intp)
+        pk = p*p
+        while pk < stop:
+            offset_k = -start % pk
+            exponents[(offset_k-offset)//p::pk//p] += 1
+            parts[offset_k::pk] *= p
+            pk *= p
+        table = np.array([0] + [fpp(p, e) for e in range(1, exponents.max()+1)],
+                         dtype=np.int64)
+        values[offset::p] *= table[exponents]
+    rem = np.arange(start, stop, dtype=np.int64) // parts
+    big = rem > 1
+    values[big] *= fpp(rem[big], 1)
+    if start == 0:
+        values[0] = 0
+    return values
+
+def phi(n):
+    """ Returns Euler's totient function for every number up to n
+    (inclusive), as an array.
+    """
+    return sieve(phi_pp, 0, n+1)
+
+def mobius(n):
+    """ Returns the Mobius function for every number up to n (inclusive),
+    as an int8 array.
+    """
+    return sieve(mobius_pp, 0, n+1).astype(np.int8)
+
+def divisor_count(n):
+    """ Returns the number of divisors of every number up to n (inclusive),
+    as an array.
+    """
+    return sieve(divisor_count_pp, 0, n+1)
+
+def divisor_sum(n, k=1):
+    """ Returns the sum of the k-th powers of the divisors of every number
+    up to n (inclusive), as an array.
+    """
+    return sieve(lambda p, e: divisor_sum_pp(p, e, k), 0, n+1)
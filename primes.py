@@ -1,8 +1,17 @@
 """ Includes some handy tools for working with prime numbers. """
+from __future__ import print_function
 import sys
 import os
-import numpy as np
 import itertools as it
+try:
+    from math import gcd as _int_gcd
+except ImportError:
+    from fractions import gcd as _int_gcd
+import lazy
+np = lazy.LazyModule('numpy')
+gmpy2 = lazy.LazyModule('gmpy2') # Optional; used if available.
+
+DATA_DIR = os.path.join(os.path.expanduser('~'), 'Files', 'gcj-data')
 
 class Primes32(object):
     """ A class that acts like a list of 32-bit primes. 
@@ -11,53 +20,68 @@ class Primes32(object):
     can be modified to generate larger lists of primes, but the memory
     requirements would be a problem.
 
-    Also, the class automatically saves the data to the hard drive and
-    will attempt to reload the data before recalculating it on future
-    executions. This saves time on computation, but the file is ~1GB.
+    The list is built lazily - nothing is loaded or calculated until the
+    first time it is used, and then it only grows as far as it needs to.
+
+    Also, the class automatically saves the complete list to the hard drive
+    and will memory-map that file rather than recalculating it on future
+    executions. This saves time on computation, but the file is ~1GB;
+    because it is memory-mapped, only the parts that are used are read.
 
-    The algorithm used is an incremental Sieve of Erastothenes.
+    The algorithm used is an incremental Sieve of Erastothenes; see
+    wheel_sieve.
     """
     GF = 1.2 # Growth factor.
     MAX_DELTA = 10**8 # The maximum amount by which to grow the list.
     MAX_END = 2**32+1 # The endpoint (non-inclusive) for primality testing.
     MAX_NP = 203280221 # The number of 32-bit primes.
+    MAX_WINDOW_END = 2**63 # The endpoint for sieving beyond the list.
 
     def __init__(self,
-            primes_path=os.path.join(os.path.expanduser('~'),
-                'Files', 'gcj-data', 'p32.npy'),
-            init_max=MAX_END,
+            primes_path=os.path.join(DATA_DIR, 'p32.npy'),
+            init_max=None,
             capacity=MAX_NP
             ):
-        """ Initializes the list, either by generating an initial list up to
-        the given max_, or by loading the file from the given path, if it is
-        found and is valid.
+        """ Initializes the list; the file at the given path is only loaded
+        (or the initial list up to init_max generated) when the list is
+        first used.
         """
-        if primes_path is not None:
-            dirname = os.path.dirname(primes_path)
-            if not os.path.isdir(dirname):
-                os.makedirs(dirname)
+        self.primes_path = primes_path
+        self.init_max = init_max
+        self.capacity = capacity
+
+    def __getattr__(self, name):
+        """ Loads the list on first access to any of its data. """
+        if name not in ('data', '_np', '_end'):
+            raise AttributeError(name)
+        self._load()
+        return self.__dict__[name]
+
+    def _load(self):
+        """ Memory-maps the saved list of primes if it is available;
+        otherwise starts a new list, extended up to init_max if one was
+        given.
+        """
+        if self.primes_path is not None:
             try:
-                self.data = np.load(primes_path)
-                self._np = len(self.data)
-                self._end = self.data[-1]+2
-                return
-            except IOError:
+                data = np.load(self.primes_path, mmap_mode='r')
+                if len(data) == self.capacity:
+                    self.data = data
+                    self._np = len(data)
+                    self._end = self.MAX_END
+                    return
+            except (IOError, ValueError):
                 pass
-        self.capacity = capacity
-        self.data = np.zeros(self.capacity, dtype=np.uint32)
+        self.data = np.zeros(1024, dtype=np.uint32)
         self.data[0] = 2 # Must contain 2 as we sieve only odd primes
         self._np = 1
         self._end = 3
-        try:
-            print("Calculating")
-            self._extend(init_max)
-            if primes_path is not None:
-                print("Saving to file")
-                np.save(primes_path, self.data)
-        except MemoryError as e:
-            if primes_path is not None:
-                os.remove(primes_path)
-            raise e
+        if self.init_max is not None:
+            self._extend(self.init_max)
+
+    def _save(self):
+        """ Saves the complete list of primes to primes_path. """
+        save_array(self.primes_path, self.data[:self._np])
 
     def __len__(self):
         """ Returns the number of primes currently in the list. """
@@ -77,7 +101,7 @@ class Primes32(object):
             try:
                 self._extend()
             except IndexError:
-                raise StopIteration
+                return
 
     def __getitem__(self, indices):
         """ Returns the i-th prime, or for a slice/sequence input returns
@@ -93,18 +117,19 @@ class Primes32(object):
                 np = max(indices)+1
             except Exception:
                 np = indices+1
-        if np >= self._np:            
+        if np is not None and np >= self._np:
             self._lengthen(np)
-        result = self.data[indices]
+        result = self.data[:self._np][indices]
         return result.astype(object)
 
     def __contains__(self, n):
         """ Returns whether the given number is in the list of primes.
 
         This is done via binary search, and hence is an
-        efficient way to test if a number is prime.
+        efficient way to test if a number is prime; to test many numbers
+        at once, use are_prime.
         """
-        if n > self._end:
+        if n >= self._end:
             self._extend(n+1)
         idx = self._insert_pos(n)
         return idx < self._np and n == self.data[idx]
@@ -115,38 +140,96 @@ class Primes32(object):
         If it is a prime, this is precisely the rank of that prime in the 
         sequence of primes.
         """
-        if n > self._end:
+        if n >= self._end:
             self._extend(n+1)
         return self._insert_pos(n)
 
+    def are_prime(self, ns):
+        """ Returns a boolean array saying whether each of the given numbers
+        (as a numpy array or any other iterable) is prime.
+
+        The list is extended at most once, up to the largest of the numbers.
+        """
+        ns, ranks = self._insert_pos_array(ns)
+        found = ranks < self._np
+        found[found] = self.data[ranks[found]] == ns[found]
+        return found
+
+    def ips(self, ns):
+        """ Returns an array of the indices that the given numbers (as a
+        numpy array or any other iterable) would have in the list; this is
+        the vectorized equivalent of ip.
+
+        The list is extended at most once, up to the largest of the numbers.
+        """
+        return self._insert_pos_array(ns)[1]
+
+    def _insert_pos_array(self, ns):
+        """ Inner method for the vectorized queries; returns the numbers as
+        an int64 array, together with their insert-positions.
+        """
+        if not isinstance(ns, np.ndarray):
+            ns = np.fromiter(ns, dtype=np.int64)
+        ns = ns.astype(np.int64, copy=False)
+        if ns.size and ns.max() >= self._end:
+            self._extend(int(ns.max())+1)
+        # Searching with uint32 keys avoids a conversion of the whole list,
+        # and searching in sorted order makes for much better cache use.
+        keys = np.clip(ns, 0, 2**32-1).astype(np.uint32).ravel()
+        order = np.argsort(keys)
+        ranks = np.empty(len(keys), dtype=np.int64)
+        ranks[order] = np.searchsorted(self.data[:self._np], keys[order])
+        return ns, ranks.reshape(ns.shape)
+
     def _insert_pos(self, n):
         """ Inner method for returing the insert-position; does not
         auto-expand the list.
         """
-        if n <= 2:
+        if n <= 0:
             return 0
-        lo = 0
-        hi = self._np
-        while hi - lo > 1:
-            mid = (lo+hi)//2
-            val = self.data[mid]
-            if val == n:
-                return mid
-            elif val < n:
-                lo = mid
-            else:
-                hi = mid
-        return hi
+        elif n >= 2**32:
+            return self._np
+        return int(np.searchsorted(self.data[:self._np], np.uint32(n)))
 
     def between(self, start, stop):
         """ Returns all the primes from start to stop.
 
         Note that start is inclusive, and stop is exclusive.
+
+        Any part of the range beyond the end of the list is sieved directly
+        rather than extending the list, and so the range may go beyond
+        32 bits; see iter_between.
         """
-        if stop > self._end:
-            self._extend(stop)
-        return self.data[self._insert_pos(start):
-                            self._insert_pos(stop)]
+        if stop <= self._end:
+            return self.data[self._insert_pos(start):
+                                self._insert_pos(stop)]
+        chunks = list(self.iter_between(start, stop))
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def iter_between(self, start, stop):
+        """ Generates the primes from start to stop as a sequence of
+        ascending arrays, for ranges with up to 63-bit endpoints.
+
+        Only the part of the range within the list is taken from the list.
+        The rest is sieved a segment at a time, with the list extended
+        only as far as the square root of stop, so the memory needed is
+        proportional to the segment size rather than the range.
+        """
+        if stop > self.MAX_WINDOW_END:
+            raise IndexError('Cannot handle >63-bit primes')
+        if start >= stop:
+            return
+        if start < self._end:
+            yield self.data[self._insert_pos(start):
+                            self._insert_pos(min(stop, self._end))]
+            start = self._end
+        if start < stop:
+            num_base = self.ip(isqrt(stop-1)+1) # This may extend the list.
+            base = self.data[:num_base]
+            for primes in wheel_sieve(start, stop, base):
+                yield primes
 
     def _extend(self, limit=None):
         """ Extends the list of primes up to the given limit.
@@ -166,24 +249,34 @@ class Primes32(object):
         while self._end < limit:
             start = self._end
             stop = min(limit, start+self.MAX_DELTA, self.MAX_END)
-            stop += 1 - stop%2
-            length = (stop - start)//2
-            is_prime = np.ones(length, dtype=bool)
-            for p in it.chain(self.data[1:self._np],
-                              it.islice(it.count(start, 2), length)):
-                p = int(p)
-                if p*p >= stop:
-                    break
-                if p >= start and not is_prime[(p-start)//2]:
-                    continue
-                first = max(((start+p-1) // (2*p) * 2 + 1), p) * p
-                is_prime[(first-start)//2::p] = False
-            new_primes = 2*is_prime.nonzero()[0] + start
-            new_np = self._np + len(new_primes)
-            self.data[self._np:new_np] = new_primes
-            self._np = new_np
+            root = isqrt(stop-1)
+            if root < self._end:
+                base = self.data[:self._insert_pos(root+1)]
+            else:
+                base = odd_sieve(root+1)
+            for new_primes in wheel_sieve(start, stop, base):
+                new_np = self._np + len(new_primes)
+                self._reserve(new_np)
+                self.data[self._np:new_np] = new_primes
+                self._np = new_np
             self._end = stop
-            
+        if self._end == self.MAX_END and self.primes_path is not None:
+            self._save()
+
+    def _reserve(self, count):
+        """ Ensures that the data array has room for at least count primes.
+
+        Once the small starting buffer is outgrown, an array of the full
+        capacity is allocated; np.zeros costs no memory until its pages are
+        written, and so, unlike growing the buffer by copying, this never
+        holds two copies of the list at once.
+        """
+        if count <= len(self.data):
+            return
+        data = np.zeros(self.capacity, dtype=np.uint32)
+        data[:self._np] = self.data[:self._np]
+        self.data = data
+
     def _lengthen(self, np=0):
         """ Lengthens the list up to the i-th prime. """
         if np > self.capacity:
@@ -191,6 +284,301 @@ class Primes32(object):
         while self._np < np:
             self._extend()
 
+class SmallestFactors(object):
+    """ A table of the smallest prime factor of every number below a limit,
+    which allows any number in range to be factorized in O(log n) steps.
+
+    Only odd numbers are stored, as a uint32 array, so the table takes
+    2 bytes per number; the smallest prime factor of a prime is itself.
+
+    The table is built on demand: queries only build it up to a little
+    past the largest number seen so far (doubling as needed), so that
+    factorizing small numbers stays cheap. Accessing data builds the whole
+    table. If a path is given, the whole table is saved there once built,
+    and memory-mapped on future executions.
+    """
+    MIN_SIZE = 2**16 # The smallest table built, in entries (odd numbers).
+
+    def __init__(self, limit, spf_path=None):
+        """ Initializes the table, for numbers below the given limit (which
+        must be at most 2**32).
+        """
+        self.limit = limit
+        self.spf_path = spf_path
+        self._data = () # Nothing is built until the first query.
+
+    def __getattr__(self, name):
+        """ Loads or builds the whole table on first access to its data. """
+        if name != 'data':
+            raise AttributeError(name)
+        self.data = self._table(self.limit - 1)
+        return self.data
+
+    def _table(self, n):
+        """ Returns the table, built far enough to cover n. """
+        if 2*len(self._data) <= n:
+            self._load(n)
+        return self._data
+
+    def _load(self, n):
+        """ Memory-maps the saved table if it is big enough; otherwise
+        builds the table up to twice n (or the limit), and saves it if it
+        is complete.
+        """
+        size = self.limit // 2
+        if self.spf_path is not None:
+            try:
+                data = np.load(self.spf_path, mmap_mode='r')
+                if len(data) >= size:
+                    self._data = data[:size]
+                    return
+            except (IOError, ValueError):
+                pass
+        size = min(size, max(self.MIN_SIZE, 2*len(self._data), n+1))
+        data = np.zeros(size, dtype=np.uint32)
+        for p in odd_sieve(isqrt(max(2*size-1, 0))+1)[1:].tolist():
+            multiples = data[p*p//2::p]
+            multiples[multiples == 0] = p
+        unset = np.flatnonzero(data == 0)
+        data[unset] = 2*unset + 1
+        self._data = data
+        if self.spf_path is not None and size == self.limit // 2:
+            save_array(self.spf_path, data)
+
+    def __contains__(self, n):
+        """ Returns whether the given number is within the table. """
+        return 0 < n < self.limit
+
+    def __getitem__(self, n):
+        """ Returns the smallest prime factor of n, which may also be
+        a numpy array of numbers.
+        """
+        if isinstance(n, np.ndarray):
+            data = self._table(int(n.max()) if n.size else 0)
+            return np.where(n & 1, data[n >> 1], 2)
+        return int(self._table(n)[n >> 1]) if n & 1 else 2
+
+    def pf(self, n):
+        """ Calculates the prime factorization of n, in the same form as
+        the pf function.
+        """
+        factors = []
+        power_of_2 = (n&-n).bit_length() - 1
+        if power_of_2 > 0:
+            factors.append((2, power_of_2))
+        n >>= power_of_2
+        data = self._table(n)
+        while n > 1:
+            p = int(data[n >> 1])
+            count = 0
+            while n%p == 0:
+                n //= p
+                count += 1
+            factors.append((p, count))
+        return factors
+
+    def factor_array(self, ns):
+        """ Factorizes every number in the given array at once.
+
+        Returns two arrays, listing every prime factor (with repetition) and
+        the index within ns of the number it belongs to; these are ordered
+        by index, and then by prime.
+        """
+        ns = np.asarray(ns, dtype=np.int64).ravel()
+        owners = np.arange(len(ns))
+        active = ns > 1
+        ns, owners = ns[active], owners[active]
+        all_owners, all_primes = [], []
+        while len(ns):
+            ps = self[ns]
+            all_owners.append(owners)
+            all_primes.append(ps)
+            ns = ns // ps
+            active = ns > 1
+            ns, owners = ns[active], owners[active]
+        if not all_owners:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        owners = np.concatenate(all_owners)
+        order = np.argsort(owners, kind='stable')
+        return owners[order], np.concatenate(all_primes)[order]
+
+def save_array(path, data):
+    """ Saves the given array as a .npy file at the given path, via
+    a temporary file so that a partial file is never left behind.
+    """
+    print("Saving to {}".format(path), file=sys.stderr)
+    temp_path = path + '.tmp'
+    try:
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(temp_path, 'wb') as f:
+            np.save(f, data)
+        os.rename(temp_path, path)
+    except (IOError, OSError, MemoryError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+# Wheel sieving, modulo 30 = 2*3*5. Each byte of a segment holds the
+# numbers 30k + r for the eight residues r coprime to 30, one bit each.
+# The arrays of the wheel are built by _load_wheel on first use.
+WHEEL_RESIDUES = None
+WHEEL_INVERSES = None # Inverses modulo 30.
+WHEEL_BITS = None # The bit for each residue.
+PRESIEVE_PERIOD = None
+PRESIEVE_PATTERN = None
+PRESIEVE_PRIMES = (7, 11, 13, 17, 19) # Struck via a repeating pattern.
+SEGMENT_BYTES = 2**18 # Segment size; this should fit within L2 cache.
+SMALL_PRIME = 512 # Primes below this are struck with strided slices.
+BASE_CHUNK = 2**20 # The number of larger primes to strike at a time.
+
+def isqrt(n):
+    """ Returns the integer square root of n, i.e. the largest integer
+    whose square is at most n.
+    """
+    if n < 0:
+        raise ValueError("Square root of negative number")
+    if n == 0:
+        return 0
+    x = 1 << ((n.bit_length()+1) // 2)
+    while True:
+        y = (x + n//x) // 2
+        if y >= x:
+            return x
+        x = y
+
+def odd_sieve(stop):
+    """ Returns all the primes below stop, via a simple sieve over the
+    odd numbers; this is only suitable for small values of stop.
+    """
+    if stop <= 2:
+        return np.zeros(0, dtype=np.int64)
+    is_prime = np.ones(stop//2, dtype=bool)
+    is_prime[0] = False
+    for i in range(1, (isqrt(stop-1)+1)//2):
+        if is_prime[i]:
+            is_prime[2*i*(i+1)::2*i+1] = False
+    primes = 2*np.flatnonzero(is_prime) + 1
+    return np.concatenate(([2], primes)).astype(np.int64)
+
+def _presieve_pattern():
+    """ Returns the wheel bytes for one period of the pre-sieving primes,
+    extended by a full segment so that any segment can be sliced out of it.
+    """
+    period = 1
+    for p in PRESIEVE_PRIMES:
+        period *= p
+    pattern = np.full(period + SEGMENT_BYTES, 255, dtype=np.uint8)
+    for p in PRESIEVE_PRIMES:
+        for b, r in enumerate(WHEEL_RESIDUES):
+            m = r * WHEEL_INVERSES[p % 30] % 30
+            pattern[p*m//30::p] &= np.uint8(255 ^ (1 << b))
+    return period, pattern
+
+def _load_wheel():
+    """ Builds the arrays of the wheel, if this has not yet been done. """
+    global WHEEL_RESIDUES, WHEEL_INVERSES, WHEEL_BITS
+    global PRESIEVE_PERIOD, PRESIEVE_PATTERN
+    if PRESIEVE_PATTERN is not None:
+        return
+    WHEEL_RESIDUES = np.array([1, 7, 11, 13, 17, 19, 23, 29], dtype=np.int64)
+    WHEEL_INVERSES = np.zeros(30, dtype=np.int64)
+    WHEEL_INVERSES[WHEEL_RESIDUES] = [1, 13, 11, 7, 23, 19, 17, 29]
+    WHEEL_BITS = np.zeros(30, dtype=np.uint8)
+    WHEEL_BITS[WHEEL_RESIDUES] = 1 << np.arange(8)
+    PRESIEVE_PERIOD, PRESIEVE_PATTERN = _presieve_pattern()
+
+def _wheel_segment(lo, size, base):
+    """ Sieves the wheel segment of the given size (in bytes) starting from
+    lo, which must be a multiple of 30, and returns the primes within it
+    other than 2, 3 and 5, in ascending order.
+
+    base must contain every prime above 5 whose square is below the end of
+    the segment, in ascending order; any other primes in it are ignored.
+    The end of the segment must be below 2**63.
+    """
+    hi = lo + 30*size
+    offset = (lo // 30) % PRESIEVE_PERIOD
+    seg = PRESIEVE_PATTERN[offset:offset+size].copy()
+    first = np.searchsorted(base, PRESIEVE_PRIMES[-1], 'right')
+    last = np.searchsorted(base, isqrt(hi-1), 'right')
+    num_small = max(first, np.searchsorted(base, SMALL_PRIME))
+    # Small primes strike many bytes each, so one slice per prime.
+    small = base[first:num_small].astype(np.int64)
+    for mask, starts in _wheel_starts(lo, small):
+        for p, k in zip(small.tolist(), starts.tolist()):
+            seg[k::p] &= mask
+    # Large primes strike few bytes each, so strike them all at once;
+    # this is done in chunks to bound the memory used.
+    num_large = max(num_small, min(last, np.searchsorted(base, 30*size)))
+    for i in range(num_small, num_large, BASE_CHUNK):
+        large = base[i:min(i+BASE_CHUNK, num_large)].astype(np.int64)
+        for mask, starts in _wheel_starts(lo, large):
+            hit = starts < size
+            steps, starts = large[hit], starts[hit]
+            if not len(steps):
+                continue
+            counts = (size - starts + steps - 1) // steps
+            ends = np.cumsum(counts)
+            deltas = np.repeat(steps, counts)
+            deltas[ends-counts] = starts - np.concatenate(
+                ([0], (starts + (counts-1)*steps)[:-1]))
+            seg[np.cumsum(deltas)] &= mask
+    # Primes longer than the segment have at most one multiple within it.
+    for i in range(num_large, last, BASE_CHUNK):
+        huge = base[i:min(i+BASE_CHUNK, last)].astype(np.int64)
+        offsets = -lo % huge
+        hit = (offsets < 30*size) & (lo + offsets > huge)
+        offsets = offsets[hit]
+        bits = WHEEL_BITS[offsets % 30]
+        coprime = bits != 0
+        np.bitwise_and.at(seg, offsets[coprime] // 30, ~bits[coprime])
+    idx = np.flatnonzero(np.unpackbits(seg, bitorder='little').view(bool))
+    primes = idx >> 3
+    primes *= 30
+    primes += WHEEL_RESIDUES.take(idx & 7)
+    primes += lo
+    if lo == 0: # Fix up 1 and the pre-sieving primes.
+        primes = np.concatenate((PRESIEVE_PRIMES,
+                                 primes[primes > PRESIEVE_PRIMES[-1]]))
+    return primes
+
+def _wheel_starts(lo, primes):
+    """ For each of the eight wheel residues, yields the bit mask for that
+    residue and the byte offsets (relative to lo) of the first multiple of
+    each prime that lies in that residue class and is at least max(lo, p*p).
+    """
+    # That multiple is p*m, where m is congruent to r / p mod 30. Offsets
+    # are taken relative to q*p, where q = lo // p, to avoid overflowing
+    # 64 bits.
+    inverses = WHEEL_INVERSES[primes % 30]
+    q, rem = np.divmod(lo, primes)
+    m_min = np.maximum(primes, q + (rem > 0))
+    for b, r in enumerate(WHEEL_RESIDUES):
+        m = m_min + (r*inverses - m_min) % 30
+        yield np.uint8(255 ^ (1 << b)), (primes*(m-q) - rem) // 30
+
+def wheel_sieve(start, stop, base):
+    """ Generates the primes from start to stop as a sequence of ascending
+    int64 arrays, one per segment, via a segmented Sieve of Eratosthenes.
+
+    Note that start is inclusive, and stop is exclusive, and stop must be
+    at most 2**63. base must contain (at least) every prime whose square
+    is below stop, as an ascending array.
+    """
+    _load_wheel()
+    small = [p for p in (2, 3, 5) if start <= p < stop]
+    if small:
+        yield np.array(small, dtype=np.int64)
+    lo = start - start % 30
+    while lo < stop:
+        size = min(SEGMENT_BYTES, (stop - lo + 29) // 30)
+        primes = _wheel_segment(lo, size, base)
+        if lo < start or lo + 30*size > stop:
+            primes = primes[(primes >= start) & (primes < stop)]
+        yield primes
+        lo += 30*size
+
 def factors(n, pfs=None):
     """ Returns a full list of all factors of the given number. """
     if pfs is None:
@@ -240,16 +628,26 @@ def factor_pairs(n, pfs=None, ordered=False):
 def pf(n, tests=None):
     """ Calculates the prime factorization of the given number,
     as a list of base-exponent pairs, in ascending order.
+
+    Numbers within the smallest-prime-factor table spf are factorized
+    via the table. Otherwise, small factors are found by trial division,
+    and whatever remains is split with Pollard's rho (Brent's variant),
+    using a Miller-Rabin test to recognise primes. If tests is given, it
+    is used as the sequence of odd trial divisors instead, and no other
+    method is used.
     """
-    if tests is None:
-        tests = it.chain(p32, it.count(p32[-1]+2, 2))
     if n <= 1:
         return []
+    if tests is None and spf is not None and n in spf:
+        return spf.pf(n)
     factors = []
     power_of_2 = (n&-n).bit_length() - 1
     if power_of_2 > 0:
         factors.append((2, power_of_2))
     n >>= power_of_2
+    trial_division = tests is None
+    if trial_division:
+        tests = _trial_primes()
     for p in tests:
         if p * p > n:
             break
@@ -259,8 +657,191 @@ def pf(n, tests=None):
             count += 1
         if count:
             factors.append((p, count))
+    else:
+        if trial_division and n > 1:
+            factors.extend(sorted(_rho_factors(n).items()))
+            return factors
     if n > 1:
         factors.append((n, 1))
     return factors
 
+TRIAL_LIMIT = 2**10 # pf uses trial division by the primes below this.
+# The Miller-Rabin test with these bases is correct for all n < 3.3 * 10^24.
+MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+MR_LIMIT = 3317044064679887385961981
+
+def is_prime(n):
+    """ Tests whether the given number is prime.
+
+    This is a deterministic Miller-Rabin test for n < 3.3 * 10^24, and
+    hence for all 64-bit numbers; above that it is a strong probable prime
+    test, or gmpy2's is_prime if gmpy2 is available.
+    """
+    if n < 2:
+        return False
+    for p in MR_BASES:
+        if n % p == 0:
+            return n == p
+    mpz, _ = _number_tools()
+    if n >= MR_LIMIT and mpz is not int:
+        return bool(gmpy2.is_prime(n))
+    n = mpz(n)
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in MR_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n-1:
+            continue
+        for _ in range(s-1):
+            x = x * x % n
+            if x == n-1:
+                break
+        else:
+            return False
+    return True
+
+def pollard_brent(n):
+    """ Returns a non-trivial factor of the given odd composite number,
+    via Brent's variant of Pollard's rho algorithm.
+    """
+    mpz, gcd = _number_tools()
+    n = mpz(n)
+    for c in it.count(1):
+        y, r, q, g = mpz(2), 1, 1, 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y*y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(RHO_BATCH, r-k)):
+                    y = (y*y + c) % n
+                    q = q * abs(x-y) % n
+                g = gcd(q, n)
+                k += RHO_BATCH
+            r *= 2
+        if g == n: # The batch overshot; backtrack one step at a time.
+            g = 1
+            while g == 1:
+                ys = (ys*ys + c) % n
+                g = gcd(abs(x-ys), n)
+        if g != n:
+            return int(g)
+
+RHO_BATCH = 128 # The number of steps between gcd calculations.
+
+_NUMBER_TOOLS = []
+def _number_tools():
+    """ Returns the integer type and gcd function to use for big numbers;
+    these come from gmpy2 if it is available.
+    """
+    if not _NUMBER_TOOLS:
+        if gmpy2:
+            _NUMBER_TOOLS.extend((gmpy2.mpz, gmpy2.gcd))
+        else:
+            _NUMBER_TOOLS.extend((int, _int_gcd))
+    return _NUMBER_TOOLS
+
+def _rho_factors(n):
+    """ Returns the prime factors of n, which must have no factors below
+    TRIAL_LIMIT, as a dictionary mapping each prime to its exponent.
+    """
+    factors = {}
+    remaining = [n]
+    while remaining:
+        m = remaining.pop()
+        if m < TRIAL_LIMIT**2 or is_prime(m):
+            factors[m] = factors.get(m, 0) + 1
+        else:
+            d = pollard_brent(m)
+            remaining.extend((d, m//d))
+    return factors
+
+def _trial_primes(_cache=[]):
+    """ Returns the odd primes below TRIAL_LIMIT, as a list of ints. """
+    if not _cache:
+        _cache.extend(odd_sieve(TRIAL_LIMIT)[1:].tolist())
+    return _cache
+
+def prime_pi(x):
+    """ Returns the number of primes up to (and including) x.
+
+    Uses the Lucy_Hedgehog algorithm, which takes O(x^(3/4)) time and
+    O(x^(1/2)) memory, with the primes up to sqrt(x) taken from p32; hence
+    x may be well beyond 32 bits (x = 10^12 takes several seconds).
+    """
+    return int(_lucy(x, 0, None))
+
+def prime_sum(x, mod=None):
+    """ Returns the sum of the primes up to (and including) x, optionally
+    modulo mod.
+
+    This works in the same way as prime_pi. mod must be small enough that
+    sqrt(x) * mod fits within 63 bits; without mod, Python integers are
+    used for large x, which is several times slower.
+    """
+    return int(_lucy(x, 1, mod))
+
+def _lucy(x, k, mod):
+    """ Inner method for prime_pi and prime_sum; returns the sum of p**k
+    over the primes p <= x, for k = 0 or 1.
+
+    For each v of the form x // i, S(v) starts as the sum of n**k over
+    2 <= n <= v, and then sieving by each prime p removes the terms for
+    numbers whose smallest prime factor is p:
+        S(v) -= p**k * (S(v // p) - S(p - 1))
+    The values for v <= sqrt(x) are kept in small, and those for v = x // i
+    in large[i].
+    """
+    if x < 2:
+        return 0
+    r = isqrt(x)
+    dtype = np.int64
+    if mod is None and k > 0 and x >= 4*10**9:
+        dtype = object # The sums would overflow 64 bits.
+    small = np.arange(r+1, dtype=np.int64).astype(dtype)
+    quotients = np.zeros(r+1, dtype=np.int64) # The values x // i.
+    quotients[1:] = x // np.arange(1, r+1, dtype=np.int64)
+    large = quotients.astype(dtype)
+    if k == 0:
+        small -= 1
+        large -= 1
+    else:
+        # Calculate v(v+1)/2 - 1 exactly, and then reduce it if necessary.
+        small = (small.astype(object) * (small+1) // 2 - 1)
+        large = (large.astype(object) * (large+1) // 2 - 1)
+        if mod is not None:
+            small %= mod
+            large %= mod
+        small, large = small.astype(dtype), large.astype(dtype)
+    small[0] = 0
+    for p in p32.between(2, r+1).tolist():
+        weight = p**k if mod is None else p**k % mod
+        sp = small[p-1]
+        p2 = p*p
+        limit = min(r, x // p2)
+        split = min(limit, r // p)
+        # For x // i with i*p <= r, x // (i*p) is also in large.
+        large[1:split+1] -= weight * (large[p:split*p+1:p] - sp)
+        # Otherwise, it is in small.
+        if limit > split:
+            large[split+1:limit+1] -= weight * (
+                small[quotients[split+1:limit+1] // p] - sp)
+        if mod is not None:
+            large[1:limit+1] %= mod
+        if p2 <= r:
+            # v // p is constant over runs of p consecutive values of v.
+            small[p2:] -= weight * (
+                np.repeat(small[p:r//p+1], p)[:r+1-p2] - sp)
+            if mod is not None:
+                small[p2:] %= mod
+    return large[1]
+
+SPF_LIMIT = 10**7 # The limit for the default smallest-prime-factor table.
+
 p32 = Primes32()
+spf = SmallestFactors(SPF_LIMIT, os.path.join(DATA_DIR, 'spf.npy'))
@@ -17,24 +17,32 @@ except NameError:
 import os
 import sys
 # MY MODULES - available at https://github.com/lackofcheese/CodeJamLib/
-sys.path.append(os.path.join(
-    os.environ['GOOGLE_DRIVE'], 'Coding', 'GCJ', 'CodeJamLib'))
-import codejam_io
+# Found on the path, or else via CODEJAMLIB or the old GOOGLE_DRIVE folder.
+try:
+    import codejam_io
+except ImportError:
+    sys.path.append(os.environ.get('CODEJAMLIB', os.path.join(
+        os.environ.get('GOOGLE_DRIVE', ''), 'Coding', 'GCJ', 'CodeJamLib')))
+    import codejam_io
 
-def toks_line(f_in, fun=int):
-    return [fun(k) for k in f_in.readline().split()]
+# f_in is a codejam_io.TokenReader; read tokens with f_in.int(), f_in.ints(n)
+# or f_in.floats(n), and whole grids at once with f_in.array((rows, cols)).
 
 def process_first(f_in):
-    num_cases = int(f_in.readline())
+    num_cases = f_in.int()
     other_data = None
     return num_cases, other_data
 
-def process_case(f_in, f_out, case_no, other_data=None):
-    ans = solve()
+def read_case(f_in, case_no, other_data=None):
+    return ()
+
+def process_case(case_data, f_out, case_no, other_data=None):
+    ans = solve(*case_data)
     print("Case #{}: {}".format(case_no, ans), file=f_out)
 
 def solve():
     return "FAIL"
 
 if __name__ == '__main__':
-    codejam_io.process_input(process_case, process_first, __file__)
+    codejam_io.process_input(process_case, process_first, __file__,
+                             read_case=read_case)